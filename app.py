@@ -11,18 +11,25 @@ import subprocess
 import shutil
 import tempfile
 import base64
-import zipfile
-import io
+import html
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import gc
+import time
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from database import (
-    save_session, save_variation, get_analytics, init_db,
+    save_session_with_variations, get_analytics, init_db, get_active_batches,
+    get_seconds_per_variation, get_mod_breakdown, MOD_COLUMNS,
 )
+from uniquifier import (
+    uniquify_batch_ffmpeg, VariationPlanner, estimate_uniqueness, plans_to_json, plans_from_json,
+)
+from job_engine import batch_status, resumable_jobs
+from export_zip import build_zip, built_zip
+from media_server import publish, prune_if_due, start_server, media_base_url, MAX_INLINE_SIZE
+from output_catalog import catalog_add, reconcile, catalog_totals, catalog_folders, catalog_list
 
 init_db()
 
@@ -55,6 +62,9 @@ st.markdown("""
     .stButton > button[kind="primary"] { background: #007AFF; border: none; border-radius: 10px; font-weight: 600; }
     .stButton > button[kind="primary"]:hover { background: #0056CC; }
     .stDownloadButton > button { background: #2C2C2E; border: 1px solid #3A3A3C; border-radius: 8px; font-size: 0.75rem; }
+    a.dl-link { display: block; text-align: center; background: #2C2C2E; border: 1px solid #3A3A3C; border-radius: 8px;
+                font-size: 0.75rem; color: #F5F5F7 !important; text-decoration: none; padding: 6px 8px; margin-bottom: 6px; }
+    a.dl-link:hover { border-color: #007AFF; }
 
     /* Compact video in upload panel */
     .compact-video video { max-height: 180px !important; border-radius: 10px; }
@@ -160,203 +170,6 @@ st.markdown("""
 
 # ============ CORE FUNCTIONS ============
 
-def estimate_uniqueness(modifications):
-    score = 0
-    score += min(modifications.get("noise", 0) * 3, 18)
-    score += min((modifications.get("zoom", 1.0) - 1.0) * 350, 14)
-    score += min(abs(modifications.get("gamma", 1.0) - 1.0) * 200, 5)
-    score += min(abs(modifications.get("hue_shift", 0)) * 0.15, 2)
-    if modifications.get("hflip", False): score += 12
-    score += min(modifications.get("crop_percent", 0) * 2, 4)
-    score += min(abs(modifications.get("speed", 1.0) - 1.0) * 40, 3)
-    score += min(abs(modifications.get("pitch_semitones", 0)) * 35, 20)
-    score += min(abs(modifications.get("fps", 30) - 30) * 50, 5)
-    score += 3  # volume
-    if modifications.get("metadata_randomized", False): score += 5
-    score += 8  # re-encoding
-    return {'uniqueness': min(round(score), 100)}
-
-
-def _modifications_distance(mods_a, mods_b):
-    """Compare 2 sets of modifications, return distance score 0-100 (100=totally different).
-    Normalized by real parameter ranges, weighted by detection importance."""
-    # Realistic max difference per param (calibrated on medium intensity)
-    # Using medium ranges ensures threshold=30 is achievable at all intensities
-    ranges = {
-        "noise": 6.0,
-        "zoom": 0.05,
-        "gamma": 0.06,
-        "hue_shift": 12.0,
-        "crop_percent": 1.5,
-        "speed": 0.06,
-        "pitch_semitones": 1.2,
-        "fps": 0.12,
-    }
-    # Weights by detection importance (sum = 100)
-    weights = {
-        "pitch_semitones": 22,
-        "noise": 20,
-        "hflip": 15,
-        "zoom": 15,
-        "gamma": 6,
-        "fps": 6,
-        "speed": 6,
-        "crop_percent": 5,
-        "hue_shift": 5,
-    }
-    # Parameters that are offset from a base value
-    bases = {"zoom": 1.0, "gamma": 1.0, "speed": 1.0, "fps": 30.0}
-
-    score = 0.0
-    for param, max_range in ranges.items():
-        base = bases.get(param, 0.0)
-        val_a = mods_a.get(param, base) - base
-        val_b = mods_b.get(param, base) - base
-        normalized = min(abs(val_a - val_b) / max(max_range, 1e-9), 1.0)
-        score += normalized * weights.get(param, 0)
-
-    # Binary hflip
-    if mods_a.get("hflip", False) != mods_b.get("hflip", False):
-        score += weights["hflip"]
-
-    return round(min(score, 100))
-
-
-def _generate_with_diversity(input_path, output_path, intensity, enabled_mods,
-                             previous_mods_list, min_distance=30, max_retries=5):
-    """Generate a variation ensuring sufficient distance from all previous variations.
-    Retries up to max_retries times if the result is too similar to any previous set.
-    Adaptive: more retries when more previous variants exist (harder to be different).
-    Returns the best attempt (fewest fails, then highest min-dist); file on disk matches."""
-    from uniquifier import uniquify_video_ffmpeg
-
-    if not previous_mods_list:
-        return uniquify_video_ffmpeg(input_path, output_path, intensity, enabled_mods)
-
-    # Adaptive retries: scales with constraint count (more previous = harder to differ)
-    effective_retries = max_retries + min(len(previous_mods_list), 10)
-
-    best_r = None
-    best_fails = len(previous_mods_list) + 1  # worse than any real result
-    best_min_dist = -1
-    best_backup = None
-
-    for attempt in range(effective_retries + 1):
-        r = uniquify_video_ffmpeg(input_path, output_path, intensity, enabled_mods)
-        if not r.get("success"):
-            if best_backup:
-                try: os.remove(best_backup)
-                except OSError: pass
-            return r
-
-        mods = r.get("modifications", {})
-        dists = [_modifications_distance(mods, prev) for prev in previous_mods_list]
-        fails = sum(1 for d in dists if d < min_distance)
-        min_dist = min(dists)
-
-        if fails == 0:
-            # Perfect — clean up any saved backup
-            if best_backup:
-                try: os.remove(best_backup)
-                except OSError: pass
-            return r
-
-        # Better = fewer fails, then higher min_dist as tiebreaker
-        if fails < best_fails or (fails == best_fails and min_dist > best_min_dist):
-            if best_backup:
-                try: os.remove(best_backup)
-                except OSError: pass
-            best_backup = output_path + f".best{attempt}"
-            try:
-                shutil.copy2(output_path, best_backup)
-            except OSError:
-                best_backup = None
-            best_fails = fails
-            best_min_dist = min_dist
-            best_r = r
-
-    # No perfect attempt — restore the best one
-    if best_backup and best_r:
-        try:
-            shutil.move(best_backup, output_path)
-        except OSError:
-            # Move failed — clean up orphaned backup
-            try: os.remove(best_backup)
-            except OSError: pass
-        return best_r
-
-    # Fallback: return last attempt (already on disk)
-    if best_backup:
-        try: os.remove(best_backup)
-        except OSError: pass
-    return r
-
-
-def _post_diversify_variations(input_path, variations, intensity, enabled_mods,
-                                max_iterations=10, min_distance=30):
-    """Pairwise post-check: regenerate the worst-offending variant one at a time.
-    Each variation dict must have 'output_path' and 'modifications' keys.
-    Updates 'modifications' and 'uniqueness' in-place on successful regeneration."""
-    already_tried = set()  # indices we already regenerated — avoid infinite loops
-
-    for _iteration in range(max_iterations):
-        # Count failing pairs per variant index
-        fail_count = {}
-        for i in range(len(variations)):
-            for j in range(i + 1, len(variations)):
-                if _modifications_distance(variations[i]['modifications'],
-                                           variations[j]['modifications']) < min_distance:
-                    fail_count[i] = fail_count.get(i, 0) + 1
-                    fail_count[j] = fail_count.get(j, 0) + 1
-
-        if not fail_count:
-            break
-
-        # Pick the variant with the most failing pairs (that we haven't tried yet)
-        candidates = [(cnt, idx) for idx, cnt in fail_count.items() if idx not in already_tried]
-        if not candidates:
-            break
-        candidates.sort(reverse=True)
-        worst_idx = candidates[0][1]
-        already_tried.add(worst_idx)
-
-        # Regenerate against ALL other current mods
-        other_mods = [v['modifications'] for i, v in enumerate(variations) if i != worst_idx]
-        v = variations[worst_idx]
-        out = v['output_path']
-        backup = out + ".bak"
-        try:
-            shutil.copy2(out, backup)
-        except OSError:
-            backup = None
-
-        old_fail = fail_count[worst_idx]
-        r = _generate_with_diversity(input_path, out, intensity, enabled_mods,
-                                     other_mods, max_retries=15)
-        if r and r.get("success"):
-            new_mods = r.get("modifications", {})
-            new_fails = sum(1 for om in other_mods
-                            if _modifications_distance(new_mods, om) < min_distance)
-            if new_fails <= old_fail:
-                # Accept if same or better (lateral moves help escape local minima)
-                v['modifications'] = new_mods
-                v['uniqueness'] = estimate_uniqueness(new_mods)['uniqueness']
-                if new_fails < old_fail:
-                    already_tried.discard(worst_idx)  # strict improvement → allow re-try
-                if backup:
-                    try: os.remove(backup)
-                    except OSError: pass
-            else:
-                # Got worse — restore backup
-                if backup:
-                    try: shutil.move(backup, out)
-                    except OSError: pass
-        else:
-            if backup:
-                try: shutil.move(backup, out)
-                except OSError: pass
-
-
 def get_dated_folder_name():
     now = datetime.now()
     m = {1:"janvier",2:"fevrier",3:"mars",4:"avril",5:"mai",6:"juin",
@@ -441,58 +254,123 @@ def thumb_b64(path):
     return None
 
 
-@st.cache_data(ttl=300, max_entries=50)
-def _read_file_cached(path, _mtime):
-    """Read file bytes with caching — avoids reloading on every Streamlit rerun"""
-    with open(path, 'rb') as f:
-        return f.read()
+# ============ MEDIA SERVING (files stay on disk until downloaded) ============
 
+@st.cache_resource
+def _media_server():
+    """Route media (thread tornado) partagee par toutes les sessions."""
+    return start_server()
 
-def read_file_safe(path):
-    """Read file bytes safely with cache. Returns None if file missing."""
-    if not path or not os.path.exists(path):
+
+def media_url(path, download=False):
+    """URL absolue servie depuis le disque (Range, bon type MIME), ou None → repli sur un bouton."""
+    if not path or not _media_server():
         return None
     try:
-        mtime = os.path.getmtime(path)
-        return _read_file_cached(path, mtime)
-    except Exception:
+        host = st.context.headers.get("Host")
+    except AttributeError:
+        host = None  # Streamlit < 1.37: set TIKFUSION_MEDIA_URL
+    base = media_base_url(host)
+    if not base:
         return None
+    # Drop links of deleted outputs / expired ones (throttled)
+    prune_if_due()
+    rel = publish(path)
+    if not rel:
+        return None
+    return f"{base}/{rel}" + ("?dl=1" if download else "")
 
 
-def build_zip_from_analyses(analyses):
-    """ZIP en memoire a partir d'une liste d'analyses (Single/URL)"""
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for a in analyses:
-            p = a.get('output_path', '')
-            if p and os.path.exists(p):
-                zf.write(p, f"{a['name']}.mp4")
-    buf.seek(0)
-    return buf.getvalue()
-
-
-def build_zip_from_bulk_results(results, filter_safe=False):
-    """ZIP en memoire a partir des resultats bulk/farm (video_name/V01.mp4)"""
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for r in results:
-            for v in r['variations']:
-                if filter_safe and v['uniqueness'] < 60:
-                    continue
-                p = v.get('output_path', '')
-                if p and os.path.exists(p):
-                    zf.write(p, f"{r['name']}/{v['name']}.mp4")
-    buf.seek(0)
-    return buf.getvalue()
-
+def media_download(label, path, file_name, key, mime="video/mp4"):
+    """Telechargement d'un fichier de sortie sans le lire dans la session.
+    Repli (route media indisponible) : bouton en deux temps, lu apres le clic, une seule fois ;
+    au-dela de MAX_INLINE_SIZE seul le chemin est affiche."""
+    if not path or not os.path.exists(path):
+        return
+    url = media_url(path, download=True)
+    if url:
+        st.markdown(f'<a class="dl-link" href="{html.escape(url)}" download="{html.escape(file_name)}">{label}</a>',
+                    unsafe_allow_html=True)
+        return
+    size = os.path.getsize(path)
+    if size > MAX_INLINE_SIZE:
+        # Too big to go through the session: point at the file instead of loading it
+        st.caption(f"{label} — {size / (1024*1024):.0f} MB, a recuperer sur le serveur :")
+        st.code(os.path.abspath(path), language=None)
+        return
+    armed = f"armed_{key}"
+    # pop: the file is read for this render only, not again on every later rerun (job polling)
+    if st.session_state.pop(armed, False):
+        with open(path, 'rb') as f:
+            st.download_button(label, f, file_name=file_name, mime=mime, key=key, use_container_width=True)
+    elif st.button(label, key=f"arm_{key}", use_container_width=True):
+        st.session_state[armed] = True
+        st.rerun()
+
+
+def media_video(path):
+    st.video(media_url(path) or path)
+
+
+def zip_entries_from_analyses(analyses):
+    """Entrees du ZIP d'une liste d'analyses (Single/URL)"""
+    return [(f"{a['name']}.mp4", a.get('output_path', '')) for a in analyses]
+
+
+def zip_entries_from_bulk_results(results, filter_safe=False):
+    """Entrees du ZIP des resultats bulk/farm (video_name/V01.mp4).
+    Le sous-ensemble safe a sa propre archive : seules les videos safe sont relues."""
+    return [(f"{r['name']}/{v['name']}.mp4", v.get('output_path', ''))
+            for r in results for v in r['variations']
+            if not filter_safe or v['uniqueness'] >= 60]
+
+
+def zip_download_button(label, entries, out_dir, base_name, key):
+    """Archive ecrite a la demande (bouton "Preparer le ZIP"), jamais pendant un simple rendu
+    ni les reruns de suivi des jobs ; ensuite servie depuis le disque (route media)."""
+    zip_path = built_zip(entries, out_dir, base_name)
+    if not zip_path:
+        if not st.button(f"{label} · Preparer le ZIP", key=f"prep_{key}", use_container_width=True):
+            return
+        with st.spinner("Preparation du ZIP..."):
+            zip_path = build_zip(entries, out_dir, base_name)
+    media_download(label, zip_path, f"{base_name}.zip", key, mime="application/zip")
+
+
+
+# ============ BACKGROUND JOBS (Bulk / Ferme) ============
+
+@st.cache_resource
+def get_job_engine():
+    """Moteur de jobs partage par toutes les sessions — survit aux reruns et aux refresh."""
+    from job_engine import JobEngine
+    return JobEngine()
+
+
+def submit_batch_jobs(kind, batch, batch_path, uploaded_files, count, intensity, enabled_mods, workers,
+                      segmented=False, seed=None):
+    """Copie les sources hors de la session et met un job par video en file.
+    Avec `seed`, la source i est planifiee avec seed + i (run reproductible)."""
+    engine = get_job_engine()
+    from job_engine import SOURCE_DIR as src_dir
+    os.makedirs(src_dir, exist_ok=True)
+    for i, uf in enumerate(uploaded_files):
+        name = Path(uf.name).stem
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', dir=src_dir)
+        tmp.write(uf.read()); tmp.close()
+        engine.submit(kind, batch, name, {
+            "input_path": tmp.name, "output_folder": os.path.join(batch_path, name),
+            "name": name, "count": count, "intensity": intensity,
+            "enabled_mods": enabled_mods, "workers": workers, "segmented": segmented,
+            "seed": seed + i if seed is not None else None, "cleanup_input": True,
+        })
 
 
 # ============ GENERATION ENGINE (parallel + real scoring + SQLite) ============
 
 def run_generation(input_path, num_vars, output_dir, intensity, enabled_mods, progress_bar, status_el,
-                   session_mode="single", source_url=None, source_platform=None, virality_score=None):
-    from uniquifier import uniquify_video_ffmpeg, FFMPEG_BIN
-
+                   session_mode="single", source_url=None, source_platform=None, virality_score=None,
+                   workers=0, segmented=False, seed=None, plans=None):
     # Check FFmpeg is available
     ok, ffpath, info = _check_ffmpeg()
     if not ok:
@@ -504,88 +382,44 @@ def run_generation(input_path, num_vars, output_dir, intensity, enabled_mods, pr
     out_dir = os.path.join(output_dir, folder)
     os.makedirs(out_dir, exist_ok=True)
 
-    # Prepare all output paths
-    tasks = []
-    for i in range(num_vars):
-        out = os.path.join(out_dir, f"V{i+1:02d}.mp4")
-        tasks.append((i, input_path, out, intensity, enabled_mods))
+    # Plan diversified parameters up front — each variation is encoded exactly once.
+    # Imported plans are replayed as-is (same parameters, same output).
+    if plans:
+        num_vars = len(plans)
+    else:
+        plans = VariationPlanner(intensity, enabled_mods, seed=seed).plan(num_vars)
 
-    # Parallel generation (3 workers)
-    raw_results = [None] * num_vars
+    # Grouped (single decode, N outputs per ffmpeg), parallel within the core budget
+    outputs = [os.path.join(out_dir, f"V{i+1:02d}.mp4") for i in range(num_vars)]
     errors = []
     completed = 0
+    fractions = [0.0] * num_vars
+    t0 = time.time()
+
+    def _show_progress():
+        done = sum(fractions) / num_vars
+        progress_bar.progress(min(done, 1.0))
+        eta = ""
+        if 0 < done < 1:
+            remaining = (time.time() - t0) * (1 - done) / done
+            eta = f" — ~{int(remaining//60)}m{int(remaining%60):02d}s restantes"
+        status_el.text(f"⏳ {completed}/{num_vars} genere(s){eta}")
+
+    def _on_progress(idx, fraction):
+        fractions[idx] = fraction
+        _show_progress()
+
+    def _on_result(idx, r):
+        nonlocal completed
+        if not r.get("success"):
+            errors.append(f"V{idx+1:02d}: {r.get('error', 'unknown')[:150]}")
+        completed += 1
+        fractions[idx] = 1.0
+        _show_progress()
 
-    def _worker(args):
-        idx, inp, outp, intens, mods = args
-        return idx, uniquify_video_ffmpeg(inp, outp, intens, mods)
-
-    max_workers = min(3, num_vars)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(_worker, t): t[0] for t in tasks}
-        for future in as_completed(futures):
-            idx, r = future.result()
-            raw_results[idx] = r
-            if not r.get("success"):
-                errors.append(f"V{idx+1:02d}: {r.get('error', 'unknown')[:150]}")
-            completed += 1
-            progress_bar.progress(completed / num_vars)
-            status_el.text(f"⏳ {completed}/{num_vars} genere(s)...")
-
-    # Post-parallel diversity check: regenerate worst-offending variant one at a time
-    already_tried = set()
-    for _iter in range(10):
-        success_indices = [i for i, r in enumerate(raw_results) if r and r.get("success")]
-        fail_count = {}
-        for ai in range(len(success_indices)):
-            for bi in range(ai + 1, len(success_indices)):
-                ia, ib = success_indices[ai], success_indices[bi]
-                if _modifications_distance(raw_results[ia].get("modifications", {}),
-                                           raw_results[ib].get("modifications", {})) < 30:
-                    fail_count[ia] = fail_count.get(ia, 0) + 1
-                    fail_count[ib] = fail_count.get(ib, 0) + 1
-
-        if not fail_count:
-            break
-
-        candidates = [(cnt, idx) for idx, cnt in fail_count.items() if idx not in already_tried]
-        if not candidates:
-            break
-        candidates.sort(reverse=True)
-        worst_idx = candidates[0][1]
-        already_tried.add(worst_idx)
-
-        status_el.text(f"🔄 Diversification: V{worst_idx+1:02d} ({fail_count[worst_idx]} conflits)...")
-        other_mods = [raw_results[i].get("modifications", {}) for i in success_indices if i != worst_idx]
-        out = os.path.join(out_dir, f"V{worst_idx+1:02d}.mp4")
-        backup = out + ".bak"
-        try:
-            shutil.copy2(out, backup)
-        except OSError:
-            backup = None
-
-        old_fail = fail_count[worst_idx]
-        r = _generate_with_diversity(input_path, out, intensity, enabled_mods,
-                                     other_mods, max_retries=15)
-        if r and r.get("success"):
-            new_mods = r.get("modifications", {})
-            new_fails = sum(1 for om in other_mods
-                            if _modifications_distance(new_mods, om) < 30)
-            if new_fails <= old_fail:
-                # Accept same or better (lateral moves help escape local minima)
-                raw_results[worst_idx] = r
-                if new_fails < old_fail:
-                    already_tried.discard(worst_idx)
-                if backup:
-                    try: os.remove(backup)
-                    except OSError: pass
-            else:
-                if backup:
-                    try: shutil.move(backup, out)
-                    except OSError: pass
-        else:
-            if backup:
-                try: shutil.move(backup, out)
-                except OSError: pass
+    raw_results = uniquify_batch_ffmpeg(input_path, outputs, plans, workers=workers or None,
+                                        on_result=_on_result, segmented=segmented,
+                                        on_progress=_on_progress, thumbnails=True)
 
     # Show errors if any
     if errors and not any(r and r.get("success") for r in raw_results):
@@ -594,12 +428,6 @@ def run_generation(input_path, num_vars, output_dir, intensity, enabled_mods, pr
         return [], "error"
 
     # Process results + real uniqueness check + SQLite persist
-    session_id = save_session(
-        mode=session_mode, source_url=source_url,
-        source_platform=source_platform, virality_score=virality_score,
-        folder_name=folder, num_variations=num_vars, intensity=intensity
-    )
-
     results = []
     for i, r in enumerate(raw_results):
         if r and r.get("success"):
@@ -613,21 +441,23 @@ def run_generation(input_path, num_vars, output_dir, intensity, enabled_mods, pr
 
             a['name'] = Path(out).stem
             a['modifications'] = mods
+            a['plan'] = r.get("plan")
             a['output_path'] = out
-            a['thumbnail'] = extract_thumbnail(out)
-
-            # Persist to SQLite
-            save_variation(
-                session_id=session_id, name=a['name'], output_path=out,
-                uniqueness_score=a['uniqueness'],
-                tiktok_score=a.get('tiktok_score'),
-                instagram_score=a.get('instagram_score'),
-                youtube_score=a.get('youtube_score'),
-                modifications=mods
-            )
+            # Written by the encode itself; extract only for segmented encodes
+            a['thumbnail'] = r.get('thumbnail') or extract_thumbnail(out)
+            a['previews'] = r.get('previews', [])
 
             results.append(a)
 
+    # One transaction for the session and all its variations
+    save_session_with_variations(
+        dict(mode=session_mode, source_url=source_url,
+             source_platform=source_platform, virality_score=virality_score,
+             folder_name=folder, num_variations=num_vars, intensity=intensity),
+        results
+    )
+
+    catalog_add([a['output_path'] for a in results])
     gc.collect()
     return results, folder
 
@@ -685,22 +515,25 @@ def render_results(analyses, folder, prefix):
             font-size:0.78rem;color:#86868B;text-align:center">
             📊 Moy. <b style="color:#F5F5F7">{avg:.0f}%</b> &nbsp; ✅ <b style="color:#30D158">{safe}/{len(analyses)}</b> safe
         </div>""", unsafe_allow_html=True)
+    # Archives go next to the videos (built on request, reused while the files are unchanged)
+    out_dir = os.path.dirname(analyses[0].get('output_path', '')) or "."
     with top3:
-        zip_all = build_zip_from_analyses(analyses)
-        st.download_button("📦 Tout", zip_all,
-                           file_name=f"{folder}.zip", mime="application/zip",
-                           key=f"zip_{prefix}", use_container_width=True)
+        zip_download_button("📦 Tout", zip_entries_from_analyses(analyses), out_dir, folder, f"zip_{prefix}")
     with top4:
         if safe_analyses:
-            zip_safe = build_zip_from_analyses(safe_analyses)
-            st.download_button("🟢 Safe IG", zip_safe,
-                               file_name=f"{folder}_safe_instagram.zip", mime="application/zip",
-                               key=f"zipsafe_{prefix}", use_container_width=True)
+            zip_download_button("🟢 Safe IG", zip_entries_from_analyses(safe_analyses), out_dir,
+                                f"{folder}_safe_instagram", f"zipsafe_{prefix}")
         else:
             st.markdown('<div style="font-size:0.7rem;color:#FF453A;text-align:center;padding:8px">Aucune safe</div>', unsafe_allow_html=True)
 
     st.markdown("""<div class="legend">🟢 ≥60% = Safe Instagram (toutes plateformes) &nbsp;|&nbsp; 🟠 30-59% = Safe TikTok seulement &nbsp;|&nbsp; 🔴 <30% = Risque detection</div>""", unsafe_allow_html=True)
 
+    plans = [a['plan'] for a in analyses if a.get('plan')]
+    if plans:
+        st.download_button("🧾 Plans (JSON) — regenerer a l'identique", plans_to_json(plans),
+                           file_name=f"{folder}_plans.json", mime="application/json",
+                           key=f"plans_{prefix}")
+
     # HTML table grid
     st.markdown(build_grid_html(analyses), unsafe_allow_html=True)
 
@@ -713,11 +546,7 @@ def render_results(analyses, folder, prefix):
             p = a.get('output_path','')
             if p and os.path.exists(p):
                 with cols[i]:
-                    data = read_file_safe(p)
-                    if data:
-                        st.download_button(f"⬇ {a['name']}", data,
-                                           file_name=f"{a['name']}.mp4", mime="video/mp4",
-                                           key=f"dl_{prefix}_{start}_{i}", use_container_width=True)
+                    media_download(f"⬇ {a['name']}", p, f"{a['name']}.mp4", f"dl_{prefix}_{start}_{i}")
 
     # Video preview gallery — 2 per row with individual download buttons
     st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
@@ -730,15 +559,14 @@ def render_results(analyses, folder, prefix):
             p = a.get('output_path','')
             if p and os.path.exists(p):
                 with pcols[i]:
-                    st.video(p)
+                    media_video(p)
                     u = a['uniqueness']
                     badge_class, _ = get_badge(u)
                     st.markdown(f'<div style="text-align:center;margin-top:-6px"><span class="rg-name">{a["name"]}</span> &nbsp; <span class="{badge_class}" style="font-size:.72rem;padding:2px 8px">{u:.0f}%</span></div>', unsafe_allow_html=True)
-                    data = read_file_safe(p)
-                    if data:
-                        st.download_button(f"⬇ {a['name']}", data,
-                                           file_name=f"{a['name']}.mp4", mime="video/mp4",
-                                           key=f"dlprev_{prefix}_{start}_{i}", use_container_width=True)
+                    previews = [f for f in a.get('previews', []) if os.path.exists(f)]
+                    if previews:
+                        st.image(previews, width=60)
+                    media_download(f"⬇ {a['name']}", p, f"{a['name']}.mp4", f"dlprev_{prefix}_{start}_{i}")
 
 
 
@@ -746,6 +574,8 @@ def render_results(analyses, folder, prefix):
 # ============ MAIN ============
 
 def main():
+    poll_jobs = False  # set when a background Bulk/Farm batch is still running
+    get_job_engine()  # start the dispatcher once per server (resumes queued jobs after a restart)
     st.markdown("""<div class="header-bar">
         <span class="header-logo">LTP</span>
         <span class="header-title">TikFusion</span>
@@ -775,6 +605,20 @@ def main():
         with c1: output_dir = st.text_input("📁 Dossier de sortie", value="outputs", key="cfg_output")
         with c2: intensity = st.select_slider("🎚️ Intensite", options=["low","medium","high"], value="medium", key="cfg_intensity")
 
+        from uniquifier import available_cpus, encode_budget
+        _auto_w, _auto_t = encode_budget(jobs=available_cpus())
+        st.number_input("⚡ Encodages paralleles (0 = auto)", min_value=0, max_value=64, value=0, step=1,
+                        key="cfg_workers",
+                        help=f"{available_cpus()} coeurs detectes — auto: {_auto_w} ffmpeg x {_auto_t} threads. "
+                             "Surchargeable via TIKFUSION_WORKERS / TIKFUSION_THREADS.")
+        st.toggle("🧩 Encodage segmente (videos longues)", value=False, key="cfg_segmented",
+                  help="Sources >= 60s : decoupe aux keyframes, segments encodes en parallele puis concatenes.")
+        st.toggle("🎲 Graine fixe (run reproductible)", value=False, key="cfg_seed_fixed",
+                  help="Desactive : nouvelle graine aleatoire a chaque run.")
+        st.number_input("Graine", min_value=0, max_value=2**31 - 1, value=0, step=1,
+                        key="cfg_seed", disabled=not st.session_state.get("cfg_seed_fixed"),
+                        help="Meme graine + memes reglages = memes variations (Single, Bulk, Ferme). 0 est une graine valide.")
+
         st.markdown("---")
         st.markdown("### 🎛️ Modifications anti-detection")
 
@@ -862,6 +706,10 @@ def main():
     # Config values
     output_dir = st.session_state.get('cfg_output', 'outputs')
     intensity = st.session_state.get('cfg_intensity', 'medium')
+    workers = st.session_state.get('cfg_workers', 0)
+    segmented = st.session_state.get('cfg_segmented', False)
+    # 0 is a valid seed: only the toggle means "no seed"
+    seed = int(st.session_state.get('cfg_seed', 0)) if st.session_state.get('cfg_seed_fixed') else None
     enabled_mods = {k: st.session_state.get(f"mod_{k}", True)
                     for k in ["noise","zoom","gamma","hue","hflip","crop","speed","pitch","fps","meta"]}
 
@@ -884,6 +732,8 @@ def main():
                 st.markdown('</div>', unsafe_allow_html=True)
 
                 nv = st.slider("Variations", 1, 15, 5, key="single_vars")
+                plan_file = st.file_uploader("🧾 Rejouer des plans (JSON, optionnel)", type=['json'],
+                                             key="single_plans")
                 if st.button("Generer les variations", type="primary", key="single_gen", use_container_width=True):
                     tp = st.session_state.get('single_temp')
                     if not tp or not os.path.exists(tp):
@@ -893,7 +743,10 @@ def main():
 
                     prog = st.progress(0); stat = st.empty()
                     try:
-                        analyses, folder = run_generation(tp, nv, output_dir, intensity, enabled_mods, prog, stat)
+                        plans = plans_from_json(plan_file.getvalue()) if plan_file else None
+                        analyses, folder = run_generation(tp, nv, output_dir, intensity, enabled_mods, prog, stat,
+                                                          workers=workers, segmented=segmented,
+                                                          seed=seed, plans=plans)
                         stat.empty(); prog.empty()
                         if analyses:
                             st.session_state['single_analyses'] = analyses
@@ -938,70 +791,48 @@ def main():
                 st.info(f"**{len(files) * vpv} videos** au total")
 
                 if st.button("Lancer", type="primary", key="bulk_gen", use_container_width=True):
-                    bf = get_dated_folder_name() + " BULK"
-                    bp = os.path.join(output_dir, bf)
-                    os.makedirs(bp, exist_ok=True)
-                    prog = st.progress(0); stat = st.empty()
-                    all_res = []
-                    total_steps = len(files) * vpv
-                    step = 0
-                    try:
-                        ok, ffpath, info = _check_ffmpeg()
-                        if not ok:
-                            st.error(f"FFmpeg non disponible ({ffpath}): {info}")
-                            st.info("Installe `imageio-ffmpeg` (pip) ou `ffmpeg` (systeme).")
-                            raise RuntimeError("FFmpeg unavailable")
-                        for vi, uf in enumerate(files):
-                            vname = Path(uf.name).stem
-                            tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-                            tmp.write(uf.read()); tmp.close()
-
-                            vfolder = os.path.join(bp, vname)
-                            os.makedirs(vfolder, exist_ok=True)
-                            vr = {'name': vname, 'variations': [], 'success_count': 0}
-                            previous_mods = []
-
-                            for j in range(vpv):
-                                step += 1
-                                stat.text(f"⏳ [{step}/{total_steps}] {vname} — V{j+1:02d}")
-                                prog.progress(step / total_steps)
-                                op = os.path.join(vfolder, f"V{j+1:02d}.mp4")
-                                r = _generate_with_diversity(tmp.name, op, intensity, enabled_mods, previous_mods)
-                                if r.get("success"):
-                                    mods = r.get("modifications",{})
-                                    previous_mods.append(mods)
-                                    a = estimate_uniqueness(mods)
-                                    vr['variations'].append({
-                                        'name': f"V{j+1:02d}", 'output_path': op,
-                                        'uniqueness': a['uniqueness'], 'modifications': mods,
-                                        'thumbnail': extract_thumbnail(op)
-                                    })
-                                    vr['success_count'] += 1
-
-                            # Post-check pairwise diversity across all variations of this video
-                            if len(vr['variations']) > 1:
-                                stat.text(f"🔄 [{vi+1}/{len(files)}] {vname} — diversification...")
-                                try:
-                                    _post_diversify_variations(tmp.name, vr['variations'], intensity, enabled_mods)
-                                except Exception:
-                                    pass
-                                vr['success_count'] = len(vr['variations'])
-
-                            all_res.append(vr)
-                            try: os.unlink(tmp.name)
-                            except OSError: pass
-
-                        st.session_state['bulk_results'] = all_res
-                        st.session_state['bulk_folder'] = bf
-                        stat.empty(); prog.empty()
-                        total_gen = sum(r['success_count'] for r in all_res)
-                        if total_gen > 0:
-                            st.success(f"✅ {total_gen} videos generees")
-                        else:
-                            st.error("❌ Generation echouee — verifie que ffmpeg est installe")
-                    except Exception as e:
-                        stat.empty(); prog.empty()
-                        st.error(f"❌ Erreur: {e}")
+                    ok, ffpath, info = _check_ffmpeg()
+                    if not ok:
+                        st.error(f"FFmpeg non disponible ({ffpath}): {info}")
+                        st.info("Installe `imageio-ffmpeg` (pip) ou `ffmpeg` (systeme).")
+                    else:
+                        bf = get_dated_folder_name() + " BULK"
+                        bp = os.path.join(output_dir, bf)
+                        os.makedirs(bp, exist_ok=True)
+                        submit_batch_jobs("bulk", bf, bp, files, vpv, intensity, enabled_mods, workers,
+                                          segmented, seed)
+                        st.session_state['bulk_batch'] = bf
+                        st.session_state.pop('bulk_results', None)
+
+            # Background batch: reattach after a refresh, poll until finished
+            bulk_batch = st.session_state.get('bulk_batch') or next(iter(get_active_batches("bulk")), None)
+            if bulk_batch:
+                bstat = batch_status(bulk_batch)
+                if bstat['finished']:
+                    st.session_state['bulk_results'] = bstat['results']
+                    st.session_state['bulk_folder'] = bulk_batch
+                    st.session_state.pop('bulk_batch', None)
+                    total_gen = sum(r['success_count'] for r in bstat['results'])
+                    if total_gen > 0:
+                        st.success(f"✅ {total_gen} videos generees")
+                    else:
+                        st.error("❌ Generation echouee — verifie que ffmpeg est installe")
+                    for err in bstat['errors'][:3]:
+                        st.caption(f"⚠️ {err[:150]}")
+                else:
+                    st.session_state['bulk_batch'] = bulk_batch
+                    st.progress(min(bstat['done'] / max(bstat['total'], 1), 1.0))
+                    running = ", ".join(bstat['running']) or "en file"
+                    st.text(f"⏳ {int(bstat['done'])}/{bstat['total']} — {running}")
+                    poll_jobs = True
+
+            # Resume: failed sources / missing variations, valid outputs are kept (manifest.json)
+            bulk_folder = st.session_state.get('bulk_folder')
+            if not bulk_batch and bulk_folder and resumable_jobs(bulk_folder):
+                if st.button("🔁 Reprendre les variations manquantes", key="bulk_resume", use_container_width=True):
+                    get_job_engine().resume(bulk_folder)
+                    st.session_state['bulk_batch'] = bulk_folder
+                    st.rerun()
 
         with col_r:
             if 'bulk_results' in st.session_state:
@@ -1020,17 +851,15 @@ def main():
 
                 # === 2 ZIP BUTTONS ===
                 z1, z2 = st.columns(2)
+                bulk_dir = os.path.join(output_dir, bf)
                 with z1:
-                    zip_all = build_zip_from_bulk_results(results, filter_safe=False)
-                    st.download_button("📦 Tout telecharger (ZIP)", zip_all,
-                                       file_name=f"{bf}.zip", mime="application/zip",
-                                       key="zip_bulk", use_container_width=True)
+                    zip_download_button("📦 Tout telecharger (ZIP)", zip_entries_from_bulk_results(results),
+                                        bulk_dir, bf, "zip_bulk")
                 with z2:
                     if safe > 0:
-                        zip_safe = build_zip_from_bulk_results(results, filter_safe=True)
-                        st.download_button(f"🟢 Safe Instagram ({safe} videos)", zip_safe,
-                                           file_name=f"{bf}_safe_instagram.zip", mime="application/zip",
-                                           key="zipsafe_bulk", use_container_width=True)
+                        zip_download_button(f"🟢 Safe Instagram ({safe} videos)",
+                                            zip_entries_from_bulk_results(results, filter_safe=True),
+                                            bulk_dir, f"{bf}_safe_instagram", "zipsafe_bulk")
                     else:
                         st.markdown('<div style="background:#1C1C1E;border:1px solid #FF453A;border-radius:8px;padding:8px;text-align:center;font-size:0.78rem;color:#FF453A">Aucune variation safe Instagram</div>', unsafe_allow_html=True)
 
@@ -1047,12 +876,8 @@ def main():
                             p = v.get('output_path','')
                             if p and os.path.exists(p):
                                 with dl_cols[i % 5]:
-                                    data = read_file_safe(p)
-                                    if data:
-                                        st.download_button(f"⬇ {v['name']}", data,
-                                            file_name=f"{r['name']}_{v['name']}.mp4",
-                                            mime="video/mp4", key=f"dlb_{r['name']}_{v['name']}",
-                                            use_container_width=True)
+                                    media_download(f"⬇ {v['name']}", p, f"{r['name']}_{v['name']}.mp4",
+                                                   f"dlb_{r['name']}_{v['name']}")
 
                         # Video previews
                         pcols = st.columns(min(4, max(1, len(r['variations']))))
@@ -1060,7 +885,7 @@ def main():
                             p = v.get('output_path','')
                             if p and os.path.exists(p):
                                 with pcols[i % 4]:
-                                    st.video(p)
+                                    media_video(p)
                                     u = v['uniqueness']
                                     bc, _ = get_badge(u)
                                     st.markdown(f'<div style="text-align:center;margin-top:-6px;font-size:.75rem;color:#86868B">{v["name"]} <span class="{bc}" style="font-size:.68rem;padding:1px 6px">{u:.0f}%</span></div>', unsafe_allow_html=True)
@@ -1071,10 +896,48 @@ def main():
     # ===== FERME (Farm Mode) =====
     with tab_farm:
         st.markdown("### 🏭 Mode Ferme — Traitement en masse")
-        st.markdown('<div style="color:#86868B;font-size:0.82rem;margin-bottom:12px">Traitement en masse — upload tes videos et lance la generation. <b>Garde cette page ouverte</b> pendant toute la duree du traitement.</div>', unsafe_allow_html=True)
-        st.warning("⚠️ Ne ferme pas le navigateur pendant le traitement. La generation s'arrete si la connexion est coupee.")
-
-        if not st.session_state.get('farm_running') and not st.session_state.get('farm_done'):
+        st.markdown('<div style="color:#86868B;font-size:0.82rem;margin-bottom:12px">Traitement en masse — upload tes videos et lance la generation. La generation tourne <b>en arriere-plan sur le serveur</b> : tu peux fermer ou recharger la page, la progression sera retrouvee.</div>', unsafe_allow_html=True)
+
+        # Background farm: reattach after a refresh / dropped connection
+        farm_batch = st.session_state.get('farm_batch')
+        if not farm_batch and not st.session_state.get('farm_done'):
+            farm_batch = next(iter(get_active_batches("farm")), None)
+            if farm_batch:
+                st.session_state['farm_batch'] = farm_batch
+
+        if farm_batch:
+            # === PROGRESS (polled from the job queue) ===
+            fstat = batch_status(farm_batch)
+            if fstat['finished']:
+                st.session_state['farm_results'] = fstat['results']
+                st.session_state['farm_errors'] = fstat['errors']
+                st.session_state['farm_folder'] = farm_batch
+                st.session_state['farm_done'] = True
+                st.session_state.pop('farm_batch', None)
+                st.rerun()
+
+            # done is fractional (live ffmpeg -progress), so the rate tracks the real encode speed
+            completed, total_variations = fstat['done'], max(fstat['total'], 1)
+            all_scores = [v['uniqueness'] for r in fstat['results'] for v in r['variations']]
+            rate = completed / max(fstat['elapsed'], 1)
+            remaining = (total_variations - completed) / max(rate, 0.001)
+            avg_score = sum(all_scores) / len(all_scores) if all_scores else 0
+            safe_count = sum(1 for s in all_scores if s >= 60)
+
+            st.progress(min(completed / total_variations, 1.0))
+            running = ", ".join(fstat['running']) or "en file"
+            st.markdown(f"""<div style="background:#1C1C1E;border:1px solid #2C2C2E;
+                border-radius:8px;padding:8px 12px;font-size:0.85rem;color:#F5F5F7">
+                ⏳ <b>[{len(fstat['results'])}/{fstat['jobs']}]</b> {running}
+            </div>""", unsafe_allow_html=True)
+            mc1, mc2, mc3, mc4 = st.columns(4)
+            mc1.metric("✅ Termine", f"{int(completed)}/{total_variations}")
+            mc2.metric("📊 Score moyen", f"{avg_score:.0f}%")
+            mc3.metric("⏱️ Restant", f"~{int(remaining//60)}m{int(remaining%60):02d}s" if completed else "—")
+            mc4.metric("🟢 Safe Instagram", f"{safe_count}/{len(all_scores)}")
+            poll_jobs = True
+
+        elif not st.session_state.get('farm_done'):
             # === UPLOAD + CONFIG ===
             farm_files = st.file_uploader(
                 "📹 Videos sources (50+ supportees)",
@@ -1093,7 +956,8 @@ def main():
                 farm_vpv = st.slider("Variations par video", 1, 20, 5, key="farm_vpv")
 
                 total_gen = len(farm_files) * farm_vpv
-                est_seconds = total_gen * 8
+                # Measured on previous jobs; 8s/variation until there is some history
+                est_seconds = int(total_gen * (get_seconds_per_variation() or 8))
                 est_min = est_seconds // 60
                 est_sec = est_seconds % 60
 
@@ -1111,132 +975,39 @@ def main():
                 </div>""", unsafe_allow_html=True)
 
                 if st.button("🚀 Lancer la Ferme", type="primary", use_container_width=True, key="farm_start"):
-                    # Save files to temp
-                    temp_paths = []
-                    for uf in farm_files:
-                        tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-                        tmp.write(uf.read()); tmp.close()
-                        temp_paths.append((uf.name, tmp.name))
-
-                    st.session_state['farm_running'] = True
-                    st.session_state['farm_results'] = []
-
-                    # Processing loop
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    metrics_container = st.empty()
-
-                    total_videos = len(temp_paths)
-                    total_variations = total_videos * farm_vpv
-                    completed = 0
-                    all_scores = []
-                    start_time = datetime.now()
-
-                    # Check FFmpeg before starting Farm
                     ok, ffpath, info = _check_ffmpeg()
                     if not ok:
                         st.error(f"FFmpeg non disponible ({ffpath}): {info}")
                         st.info("Installe `imageio-ffmpeg` (pip) ou `ffmpeg` (systeme).")
-                        st.session_state['farm_running'] = False
                         st.stop()
 
                     farm_folder = get_dated_folder_name() + " FERME"
                     farm_path = os.path.join(output_dir, farm_folder)
                     os.makedirs(farm_path, exist_ok=True)
 
-                    farm_results = []
-
-                    try:
-                        for vi, (vname_full, vpath) in enumerate(temp_paths):
-                            video_name = Path(vname_full).stem
-                            video_folder = os.path.join(farm_path, video_name)
-                            os.makedirs(video_folder, exist_ok=True)
-
-                            video_result = {
-                                'name': video_name,
-                                'variations': [],
-                                'success_count': 0
-                            }
-                            previous_mods = []
-
-                            for j in range(farm_vpv):
-                                status_text.markdown(f"""<div style="background:#1C1C1E;border:1px solid #2C2C2E;
-                                    border-radius:8px;padding:8px 12px;font-size:0.85rem;color:#F5F5F7">
-                                    ⏳ <b>[{vi+1}/{total_videos}]</b> {video_name} — V{j+1:02d}/{farm_vpv}
-                                </div>""", unsafe_allow_html=True)
-
-                                out = os.path.join(video_folder, f"V{j+1:02d}.mp4")
-                                r = _generate_with_diversity(vpath, out, intensity, enabled_mods, previous_mods)
-
-                                if r.get("success"):
-                                    mods = r.get("modifications", {})
-                                    previous_mods.append(mods)
-                                    a = estimate_uniqueness(mods)
-                                    video_result['variations'].append({
-                                        'name': f"V{j+1:02d}",
-                                        'output_path': out,
-                                        'uniqueness': a['uniqueness'],
-                                        'modifications': mods,
-                                        'thumbnail': extract_thumbnail(out)
-                                    })
-                                    video_result['success_count'] += 1
-                                    all_scores.append(a['uniqueness'])
-
-                                completed += 1
-                                progress_bar.progress(completed / total_variations)
-
-                                # Update metrics
-                                elapsed = (datetime.now() - start_time).total_seconds()
-                                rate = completed / max(elapsed, 1)
-                                remaining = (total_variations - completed) / max(rate, 0.01)
-                                avg_score = sum(all_scores) / len(all_scores) if all_scores else 0
-                                safe_count = sum(1 for s in all_scores if s >= 60)
-
-                                with metrics_container.container():
-                                    mc1, mc2, mc3, mc4 = st.columns(4)
-                                    mc1.metric("✅ Termine", f"{completed}/{total_variations}")
-                                    mc2.metric("📊 Score moyen", f"{avg_score:.0f}%")
-                                    mc3.metric("⏱️ Restant", f"~{int(remaining//60)}m{int(remaining%60):02d}s")
-                                    mc4.metric("🟢 Safe Instagram", f"{safe_count}/{len(all_scores)}")
-
-                            # Post-check pairwise diversity across all variations of this video
-                            if len(video_result['variations']) > 1:
-                                status_text.markdown(f"""<div style="background:#1C1C1E;border:1px solid #2C2C2E;
-                                    border-radius:8px;padding:8px 12px;font-size:0.85rem;color:#F5F5F7">
-                                    🔄 <b>[{vi+1}/{total_videos}]</b> {video_name} — diversification...
-                                </div>""", unsafe_allow_html=True)
-                                try:
-                                    _post_diversify_variations(vpath, video_result['variations'], intensity, enabled_mods)
-                                except Exception:
-                                    pass
-                                video_result['success_count'] = len(video_result['variations'])
-
-                            farm_results.append(video_result)
-
-                            # Cleanup temp
-                            try: os.unlink(vpath)
-                            except OSError: pass
-
-                    except Exception as e:
-                        status_text.empty()
-                        progress_bar.empty()
-                        st.error(f"Erreur pendant le traitement: {e}")
-                    finally:
-                        # Always clean up remaining temp files
-                        for _, vpath in temp_paths:
-                            try: os.unlink(vpath)
-                            except OSError: pass
-
-                    st.session_state['farm_results'] = farm_results
-                    st.session_state['farm_folder'] = farm_folder
-                    st.session_state['farm_running'] = False
-                    st.session_state['farm_done'] = True
+                    submit_batch_jobs("farm", farm_folder, farm_path, farm_files, farm_vpv,
+                                      intensity, enabled_mods, workers, segmented, seed)
+                    st.session_state['farm_batch'] = farm_folder
                     st.rerun()
 
         elif st.session_state.get('farm_done'):
             # === RESULTS ===
             results = st.session_state.get('farm_results', [])
             farm_folder = st.session_state.get('farm_folder', '')
+            for err in st.session_state.get('farm_errors', [])[:3]:
+                st.warning(f"⚠️ {err[:200]}")
+            for err in [f"{r['name']} — {e}" for r in results for e in r.get('errors', [])][:3]:
+                st.warning(f"⚠️ {err[:200]}")
+
+            # Resume: only missing or corrupted Vxx.mp4 are re-encoded (manifest.json per source)
+            missing = resumable_jobs(farm_folder) if farm_folder else []
+            if missing:
+                if st.button(f"🔁 Reprendre ({len(missing)} source(s) incompletes)", key="farm_resume",
+                             use_container_width=True):
+                    get_job_engine().resume(farm_folder)
+                    st.session_state['farm_batch'] = farm_folder
+                    st.session_state['farm_done'] = False
+                    st.rerun()
 
             if results:
                 allv = [v for r in results for v in r['variations']]
@@ -1259,17 +1030,15 @@ def main():
 
                 # === 2 ZIP BUTTONS ===
                 z1, z2 = st.columns(2)
+                farm_dir = os.path.join(output_dir, farm_folder)
                 with z1:
-                    zip_all = build_zip_from_bulk_results(results, filter_safe=False)
-                    st.download_button("📦 Tout telecharger (ZIP)", zip_all,
-                                       file_name=f"{farm_folder}.zip", mime="application/zip",
-                                       key="zip_farm", use_container_width=True)
+                    zip_download_button("📦 Tout telecharger (ZIP)", zip_entries_from_bulk_results(results),
+                                        farm_dir, farm_folder, "zip_farm")
                 with z2:
                     if safe > 0:
-                        zip_safe = build_zip_from_bulk_results(results, filter_safe=True)
-                        st.download_button(f"🟢 Safe Instagram ({safe} videos)", zip_safe,
-                                           file_name=f"{farm_folder}_safe_instagram.zip", mime="application/zip",
-                                           key="zipsafe_farm", use_container_width=True)
+                        zip_download_button(f"🟢 Safe Instagram ({safe} videos)",
+                                            zip_entries_from_bulk_results(results, filter_safe=True),
+                                            farm_dir, f"{farm_folder}_safe_instagram", "zipsafe_farm")
                     else:
                         st.markdown('<div style="background:#1C1C1E;border:1px solid #FF453A;border-radius:8px;padding:8px;text-align:center;font-size:0.78rem;color:#FF453A">Aucune variation safe Instagram</div>', unsafe_allow_html=True)
 
@@ -1287,12 +1056,8 @@ def main():
                                 p = v.get('output_path','')
                                 if p and os.path.exists(p):
                                     with dl_cols[i % 5]:
-                                        data = read_file_safe(p)
-                                        if data:
-                                            st.download_button(f"⬇ {v['name']}", data,
-                                                file_name=f"{r['name']}_{v['name']}.mp4",
-                                                mime="video/mp4", key=f"dlf_{r['name']}_{v['name']}",
-                                                use_container_width=True)
+                                        media_download(f"⬇ {v['name']}", p, f"{r['name']}_{v['name']}.mp4",
+                                                       f"dlf_{r['name']}_{v['name']}")
 
                         # Video previews
                         if r['variations']:
@@ -1301,7 +1066,7 @@ def main():
                                 p = v.get('output_path','')
                                 if p and os.path.exists(p):
                                     with pcols[i % 4]:
-                                        st.video(p)
+                                        media_video(p)
                                         u = v['uniqueness']
                                         bc, _ = get_badge(u)
                                         st.markdown(f'<div style="text-align:center;margin-top:-6px;font-size:.75rem;color:#86868B">{v["name"]} <span class="{bc}" style="font-size:.68rem;padding:1px 6px">{u:.0f}%</span></div>', unsafe_allow_html=True)
@@ -1309,7 +1074,7 @@ def main():
                 # Reset button
                 st.markdown("<div style='height:12px'></div>", unsafe_allow_html=True)
                 if st.button("🔄 Nouvelle session Ferme", key="farm_reset", use_container_width=True):
-                    for k in ['farm_results', 'farm_done', 'farm_folder', 'farm_running']:
+                    for k in ['farm_results', 'farm_errors', 'farm_done', 'farm_folder', 'farm_batch']:
                         st.session_state.pop(k, None)
                     st.rerun()
 
@@ -1318,22 +1083,26 @@ def main():
     with tab_stats:
         st.markdown("### 📊 Statistiques")
 
-        # ---- Disk stats (always available) ----
+        # ---- Disk stats (catalog in tikfusion.db, only changed directories are re-read) ----
         if os.path.exists(output_dir):
-            vids = list(Path(output_dir).rglob("*.mp4"))
-            folders = [f for f in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, f))]
-            sz = sum(f.stat().st_size for f in vids) / (1024*1024)
+            reconcile(output_dir)
+            catalog = catalog_folders(output_dir)
+            n_vids, n_bytes = catalog_totals(output_dir)
             dc1, dc2, dc3 = st.columns(3)
-            dc1.metric("📁 Dossiers", len(folders))
-            dc2.metric("📹 Videos sur disque", len(vids))
-            dc3.metric("💾 Espace utilise", f"{sz:.1f} MB")
+            dc1.metric("📁 Dossiers", len(catalog))
+            dc2.metric("📹 Videos sur disque", n_vids)
+            dc3.metric("💾 Espace utilise", f"{n_bytes / (1024*1024):.1f} MB")
         else:
             st.info("Aucun dossier de sortie detecte.")
 
         st.markdown("---")
 
-        # ---- SQLite analytics ----
-        analytics = get_analytics()
+        # ---- SQLite analytics (rollup tables, O(1) whatever the history size) ----
+        period = st.selectbox("Periode", ["Tout", "30 derniers jours", "7 derniers jours", "Aujourd'hui"],
+                              key="stats_period")
+        period_days = {"30 derniers jours": 29, "7 derniers jours": 6, "Aujourd'hui": 0}.get(period)
+        period_start = (datetime.now(timezone.utc) - timedelta(days=period_days)).date() if period_days is not None else None
+        analytics = get_analytics(start=period_start)
 
         # KPI row
         k1, k2, k3, k4, k5 = st.columns(5)
@@ -1412,21 +1181,13 @@ def main():
 
         # ---- Modification effectiveness ----
         st.markdown("#### Modifications les plus efficaces (variations >=70%)")
-        mod_samples = analytics.get("high_score_mod_samples", [])
-        if mod_samples:
-            mod_counts = {}
-            for mods in mod_samples:
-                if isinstance(mods, list):
-                    for m in mods:
-                        name = m if isinstance(m, str) else m.get("name", str(m))
-                        mod_counts[name] = mod_counts.get(name, 0) + 1
-                elif isinstance(mods, dict):
-                    for k in mods:
-                        mod_counts[k] = mod_counts.get(k, 0) + 1
+        high_count = analytics.get("high_score_count", 0)
+        if high_count:
+            mod_counts = analytics.get("high_score_mod_counts", {})
             if mod_counts:
                 sorted_mods = sorted(mod_counts.items(), key=lambda x: -x[1])
                 for mod_name, count in sorted_mods:
-                    pct = round(count / len(mod_samples) * 100)
+                    pct = round(count / high_count * 100)
                     st.markdown(f"""
                     <div style="display:flex;align-items:center;gap:10px;margin-bottom:4px">
                         <code style="min-width:120px;color:#66cc8a">{mod_name}</code>
@@ -1440,6 +1201,20 @@ def main():
         else:
             st.caption("Aucune variation avec score >=70% enregistree.")
 
+        # Score by parameter value, aggregated in SQL over the whole history (typed mod_* columns)
+        with st.expander("Score moyen par valeur de parametre"):
+            bc1, bc2 = st.columns(2)
+            bd_mod = bc1.selectbox("Parametre", list(MOD_COLUMNS), key="stats_mod")
+            bd_int = bc2.selectbox("Intensite", ["Toutes", "low", "medium", "high"], key="stats_mod_intensity")
+            breakdown = get_mod_breakdown(bd_mod, intensity=None if bd_int == "Toutes" else bd_int)
+            if breakdown:
+                st.dataframe([{
+                    "Valeur": b["bucket"], "Variations": b["n"],
+                    "Score moyen": b["avg_uniqueness"], "Taux safe (%)": b["safe_rate"],
+                } for b in breakdown], use_container_width=True, hide_index=True)
+            else:
+                st.caption("Pas assez de donnees.")
+
         st.markdown("---")
 
         # ---- Recent sessions ----
@@ -1473,26 +1248,36 @@ def main():
         if os.path.exists(output_dir):
             st.markdown("---")
             st.markdown("#### Arborescence des dossiers")
-            folders = [f for f in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, f))]
-            farm_folders = [f for f in sorted(folders, reverse=True) if "FERME" in f]
-            bulk_folders = [f for f in sorted(folders, reverse=True) if "BULK" in f]
-            other_folders = [f for f in sorted(folders, reverse=True) if "FERME" not in f and "BULK" not in f]
+            farm_folders = [c for c in catalog if "FERME" in c[0]]
+            bulk_folders = [c for c in catalog if "BULK" in c[0]]
+            other_folders = [c for c in catalog if "FERME" not in c[0] and "BULK" not in c[0]]
 
             if farm_folders:
                 st.markdown("**🏭 Ferme**")
-                for f in farm_folders:
-                    n = len(list(Path(os.path.join(output_dir, f)).rglob("*.mp4")))
-                    st.text(f"  📁 {f} — {n} videos")
+                for f, n, size in farm_folders:
+                    st.text(f"  📁 {f} — {n} videos ({size / (1024*1024):.0f} MB)")
             if bulk_folders:
                 st.markdown("**📦 Bulk**")
-                for f in bulk_folders:
-                    n = len(list(Path(os.path.join(output_dir, f)).rglob("*.mp4")))
-                    st.text(f"  📁 {f} — {n} videos")
+                for f, n, size in bulk_folders:
+                    st.text(f"  📁 {f} — {n} videos ({size / (1024*1024):.0f} MB)")
             if other_folders:
                 st.markdown("**📤 Single / Import**")
-                for f in other_folders:
-                    n = len(list(Path(os.path.join(output_dir, f)).rglob("*.mp4")))
-                    st.text(f"  📁 {f} — {n} videos")
+                for f, n, size in other_folders:
+                    st.text(f"  📁 {f} — {n} videos ({size / (1024*1024):.0f} MB)")
+
+            if catalog:
+                picked = st.selectbox("Contenu d'un dossier", [c[0] for c in catalog], key="stats_folder")
+                listing = catalog_list(os.path.join(output_dir, picked))
+                st.dataframe([{
+                    "Fichier": os.path.relpath(e['path'], os.path.abspath(os.path.join(output_dir, picked))),
+                    "Taille (MB)": round(e['size'] / (1024*1024), 1),
+                    "Modifie": datetime.fromtimestamp(e['mtime_ns'] / 1e9).strftime("%Y-%m-%d %H:%M"),
+                } for e in listing], use_container_width=True, hide_index=True)
+
+    # Background jobs keep running server-side; refresh the view until they finish
+    if poll_jobs:
+        time.sleep(2)
+        st.rerun()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
-from .uniquifier import VideoUniquifier, uniquify_video_ffmpeg, batch_uniquify, FFMPEG_BIN, FFPROBE_BIN
+from .uniquifier import VideoUniquifier, VariationPlanner, uniquify_video_ffmpeg, uniquify_batch_ffmpeg, batch_uniquify, FFMPEG_BIN, FFPROBE_BIN
+from .uniquifier import plan_to_json, plan_from_json, plans_to_json, plans_from_json
 from .video_processor import VideoProcessor
 from .uniqueness_checker import UniquenessChecker
@@ -5,20 +5,14 @@ import subprocess
 import tempfile
 import os
 
-from uniquifier import FFMPEG_BIN, FFPROBE_BIN
+from uniquifier import FFMPEG_BIN
+from media_probe import probe
 
 
 def get_duration(video_path):
     """Duree de la video en secondes"""
-    if not FFPROBE_BIN:
-        return 30
-    try:
-        cmd = [FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration",
-               "-of", "default=noprint_wrappers=1:nokey=1", video_path]
-        r = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        return float(r.stdout.strip())
-    except Exception:
-        return 30
+    info = probe(video_path)
+    return info.duration if info and info.duration else 30
 
 
 def extract_text_from_video(video_path, num_frames=8):
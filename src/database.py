@@ -5,38 +5,242 @@ Stores sessions, variations, publications, results for analytics.
 import sqlite3
 import json
 import os
+import time
+import queue
+import atexit
+import threading
+import logging
+import functools
+from pathlib import Path
+from concurrent.futures import Future
 from datetime import datetime
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tikfusion.db")
 
 
-class _DBConnection:
-    """Context manager for safe database connection handling."""
+# Connection tuning, applied once per connection
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 128 * 1024 * 1024
+
+# Writes drained from the queue and committed together (one fsync for the group)
+WRITE_BATCH = 256
+# Attempts of a group whose transaction hits another process' write lock
+WRITE_RETRIES = 50
+
+_local = threading.local()
+log = logging.getLogger(__name__)
+
+
+def _tune(conn):
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def _connect_writer():
+    # Autocommit mode: the writer issues BEGIN / SAVEPOINT / COMMIT itself
+    conn = _tune(sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None))
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL: a commit is durable once the WAL is checkpointed, never corrupt
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _connect_reader():
+    uri = Path(DB_PATH).absolute().as_uri() + "?mode=ro"
+    conn = _tune(sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000))
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def _is_busy(e):
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class _Writer:
+    """Single writer of this process: a thread owning the only write connection.
+    Queued writes are committed in groups; each runs in its own SAVEPOINT, so a failing
+    write is rolled back alone. A group blocked by another process is retried, never dropped."""
+
     def __init__(self):
+        self.pid = os.getpid()
         self.conn = None
+        self._path = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="tikfusion-db-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush, 30)
+
+    def in_writer(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn):
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is committed."""
+        self.submit(lambda conn: None).result(timeout)
+
+    def _loop(self):
+        while True:
+            group = [self._queue.get()]
+            while len(group) < WRITE_BATCH:
+                try:
+                    group.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self._path != DB_PATH:
+                    if self.conn:
+                        self.conn.close()
+                    self.conn, self._path = _connect_writer(), DB_PATH
+            except sqlite3.Error as e:
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+            self._commit(group)
+
+    def _commit(self, group):
+        conn = self.conn
+        for attempt in range(WRITE_RETRIES):
+            outcomes = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, _ in group:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        outcomes.append((True, fn(conn)))
+                    except Exception as e:
+                        if isinstance(e, sqlite3.OperationalError) and _is_busy(e):
+                            raise
+                        conn.execute("ROLLBACK TO op")
+                        outcomes.append((False, e))
+                    conn.execute("RELEASE op")
+                conn.execute("COMMIT")
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                if _is_busy(e) and attempt < WRITE_RETRIES - 1:
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+                    continue
+                for _, future in group:
+                    future.set_exception(e)
+                return
+            for (_, future), (ok, value) in zip(group, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            return
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = _Writer()
+        return _writer
+
+
+def write(fn, wait=True):
+    """Run fn(conn) on the writer thread, inside a committed transaction, and return its result.
+    wait=False returns a Future instead: the caller (an encode worker) never blocks on SQLite.
+    Called from the writer itself (a write helper inside another), fn joins the open transaction."""
+    writer = _get_writer()
+    if writer.in_writer():
+        result = fn(writer.conn)
+        if wait:
+            return result
+        future = Future()
+        future.set_result(result)
+        return future
+    future = writer.submit(fn)
+    if wait:
+        return future.result()
+    # Nobody waits on it: a failure must still leave a trace
+    future.add_done_callback(functools.partial(_log_failed_write, getattr(fn, "__name__", "write")))
+    return future
+
+
+def _log_failed_write(name, future):
+    error = future.exception()
+    if error is not None:
+        log.error("queued write %s failed: %s", name, error)
+
+
+def flush_writes(timeout=None):
+    """Block until the writes queued by this process are committed (before a worker exits)."""
+    _get_writer().flush(timeout)
+
+
+def _write_op(wait=True):
+    """Decorator: fn(conn, ...) becomes a helper fn(...) executed by write()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def helper(*args, **kwargs):
+            op = lambda conn: fn(conn, *args, **kwargs)
+            op.__name__ = fn.__name__
+            return write(op, wait=wait)
+        return helper
+    return decorate
+
+
+def get_db():
+    """Read-only connection of the calling thread (WAL: never blocked by the writer).
+    Opened on first use and reused afterwards — do not close it."""
+    key = (DB_PATH, os.getpid())
+    if getattr(_local, "key", None) != key:
+        _local.conn = _connect_reader()
+        _local.key = key
+    return _local.conn
+
+
+class _DBConnection:
+    """Scope of one read helper, on the thread's read-only connection."""
     def __enter__(self):
-        self.conn = sqlite3.connect(DB_PATH)
-        self.conn.row_factory = sqlite3.Row
-        self.conn.execute("PRAGMA journal_mode=WAL")
-        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn = get_db()
         return self.conn
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn:
-            self.conn.close()
         return False
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA foreign_keys=ON")
-    return conn
+# ---- Schema migrations ----
+# PRAGMA user_version = number of migrations applied. Append new steps, never edit shipped ones.
+# Steps stay idempotent (IF NOT EXISTS / _add_column): dbs created before the runner are at 0.
 
+def _execute_script(conn, script):
+    """executescript() commits first; this runs the statements inside the caller's transaction."""
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            conn.execute(stmt)
+            stmt = ""
+    if stmt.strip():
+        conn.execute(stmt)
 
-def init_db():
-    with _DBConnection() as conn:
-        conn.executescript("""
+
+def _add_column(conn, table, column, decl):
+    """Columns added after a table shipped (CREATE TABLE IF NOT EXISTS skips existing tables)."""
+    cols = {r['name'] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migrate_base_tables(conn):
+    _execute_script(conn, """
         CREATE TABLE IF NOT EXISTS sessions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             created_at TEXT NOT NULL DEFAULT (datetime('now')),
@@ -90,25 +294,173 @@ def init_db():
             created_at TEXT NOT NULL DEFAULT (datetime('now')),
             FOREIGN KEY (publication_id) REFERENCES publications(id) ON DELETE CASCADE
         );
-        """)
+    """)
+
+
+def _migrate_jobs(conn):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            batch TEXT NOT NULL,
+            name TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload_json TEXT NOT NULL,
+            progress_done REAL DEFAULT 0,
+            progress_total INTEGER DEFAULT 0,
+            result_json TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            started_at TEXT,
+            finished_at TEXT
+        );
+    """)
+
+
+def _migrate_variation_plans(conn):
+    _add_column(conn, "variations", "plan_json", "TEXT")
+
+
+def _migrate_output_catalog(conn):
+    # see output_catalog.py: videos on disk + last seen directory mtimes
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS catalog_files (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_catalog_files_dir ON catalog_files(dir);
+
+        CREATE TABLE IF NOT EXISTS catalog_dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_catalog_dirs_parent ON catalog_dirs(parent);
+    """)
+
+
+def _migrate_analytics_rollups(conn):
+    _execute_script(conn, _analytics_schema())
+    rebuild_analytics()
+
+
+def _migrate_indexes(conn):
+    # One index per access path: filter columns first, then the ORDER BY column
+    _execute_script(conn, """
+        CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at);
+        CREATE INDEX IF NOT EXISTS idx_sessions_mode_created ON sessions(mode, created_at);
+        CREATE INDEX IF NOT EXISTS idx_sessions_mode_folder ON sessions(mode, folder_name);
+        CREATE INDEX IF NOT EXISTS idx_variations_session_name ON variations(session_id, name);
+        CREATE INDEX IF NOT EXISTS idx_publications_created ON publications(created_at);
+        CREATE INDEX IF NOT EXISTS idx_publications_status_created ON publications(status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_publications_variation ON publications(variation_id);
+        CREATE INDEX IF NOT EXISTS idx_pub_results_publication ON pub_results(publication_id);
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+        CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch, id);
+        CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs(kind, status, batch);
+        ANALYZE;
+    """)
+
+
+# Typed views of modifications_json: mod name -> (json key, bucket step for get_mod_breakdown)
+MOD_COLUMNS = {
+    "speed": ("speed", 0.02),
+    "zoom": ("zoom", 0.02),
+    "noise": ("noise", 2),
+    "pitch": ("pitch_semitones", 0.2),
+    "fps": ("fps", 1),
+    "crop": ("crop_percent", 1),
+    "gamma": ("gamma", 0.05),
+    "hue": ("hue_shift", 5),
+    "crf": ("crf", 1),
+    "gop": ("gop", 10),
+    "hflip": ("hflip", 1),
+}
+
+
+def _migrate_mod_columns(conn):
+    # Virtual generated columns: computed from modifications_json, nothing to keep in sync.
+    # (mod_x, uniqueness_score) indexes make per-bucket score aggregates index-only scans.
+    for mod, (key, _) in MOD_COLUMNS.items():
+        _add_column(conn, "variations", f"mod_{mod}",
+                    f"REAL GENERATED ALWAYS AS (CASE WHEN json_valid(modifications_json) "
+                    f"THEN json_extract(modifications_json, '$.{key}') END) VIRTUAL")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_variations_mod_{mod} "
+                     f"ON variations(mod_{mod}, uniqueness_score)")
+    conn.execute("ANALYZE variations")
+
+
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_jobs,
+    _migrate_variation_plans,
+    _migrate_output_catalog,
+    _migrate_analytics_rollups,
+    _migrate_indexes,
+    _migrate_mod_columns,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+@_write_op()
+def schema_version(conn):
+    # Through the writer: it creates the file, readers are read-only
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    """Apply the pending migrations, each with its user_version bump in one transaction."""
+    for target in range(schema_version() + 1, SCHEMA_VERSION + 1):
+        def step(conn, target=target):
+            # Re-checked under the write lock: another process may have migrated meanwhile
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+                return
+            MIGRATIONS[target - 1](conn)
+            conn.execute(f"PRAGMA user_version={target}")
+        write(step)
+    return schema_version()
+
+
+# Minimum seconds between two PRAGMA optimize runs (see optimize_db)
+OPTIMIZE_INTERVAL = 6 * 3600
+_last_optimize = 0.0
+
+
+def optimize_db(force=False):
+    """PRAGMA optimize: re-ANALYZE only the tables whose statistics drifted.
+    Throttled; called at startup and from the job dispatcher loop."""
+    global _last_optimize
+    now = time.monotonic()
+    if not force and _last_optimize and now - _last_optimize < OPTIMIZE_INTERVAL:
+        return False
+    _last_optimize = now
+    write(lambda conn: conn.execute("PRAGMA optimize"), wait=False)
+    return True
+
+
+def init_db():
+    """Upgrade tikfusion.db in place to SCHEMA_VERSION."""
+    migrate()
+    optimize_db()
 
 
 # ---- Sessions ----
 
-def save_session(mode, source_url=None, source_platform=None,
+@_write_op()
+def save_session(conn, mode, source_url=None, source_platform=None,
                  virality_score=None, folder_name=None,
                  num_variations=0, intensity="medium"):
-    with _DBConnection() as conn:
-        cur = conn.execute(
-            """INSERT INTO sessions (mode, source_url, source_platform, virality_score,
-               folder_name, num_variations, intensity)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (mode, source_url, source_platform, virality_score,
-             folder_name, num_variations, intensity)
-        )
-        sid = cur.lastrowid
-        conn.commit()
-        return sid
+    cur = conn.execute(
+        """INSERT INTO sessions (mode, source_url, source_platform, virality_score,
+           folder_name, num_variations, intensity)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (mode, source_url, source_platform, virality_score,
+         folder_name, num_variations, intensity)
+    )
+    sid = cur.lastrowid
+    return sid
 
 
 def get_sessions(limit=50, mode=None):
@@ -133,21 +485,60 @@ def get_session(session_id):
 
 # ---- Variations ----
 
-def save_variation(session_id, name, output_path, uniqueness_score,
+@_write_op()
+def save_variation(conn, session_id, name, output_path, uniqueness_score,
                    tiktok_score=None, instagram_score=None, youtube_score=None,
-                   modifications=None):
-    with _DBConnection() as conn:
-        mods_json = json.dumps(modifications) if modifications else None
-        cur = conn.execute(
-            """INSERT INTO variations (session_id, name, output_path, uniqueness_score,
-               tiktok_score, instagram_score, youtube_score, modifications_json)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (session_id, name, output_path, uniqueness_score,
-             tiktok_score, instagram_score, youtube_score, mods_json)
+                   modifications=None, plan=None):
+    mods_json = json.dumps(modifications) if modifications else None
+    plan_json = json.dumps(plan, sort_keys=True) if plan else None
+    cur = conn.execute(
+        """INSERT INTO variations (session_id, name, output_path, uniqueness_score,
+           tiktok_score, instagram_score, youtube_score, modifications_json, plan_json)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (session_id, name, output_path, uniqueness_score,
+         tiktok_score, instagram_score, youtube_score, mods_json, plan_json)
+    )
+    vid = cur.lastrowid
+    return vid
+
+
+@_write_op()
+def save_session_with_variations(conn, session, variations, replace=False):
+    """Session + all its variations in one transaction (one commit, executemany).
+    session: kwargs of save_session. variations: dicts with name, output_path, uniqueness
+    and optionally tiktok_score / instagram_score / youtube_score, modifications, plan.
+    replace=True first drops the session with the same mode + folder_name (resumed jobs)."""
+    rows = []
+    for v in variations:
+        mods, plan = v.get('modifications'), v.get('plan')
+        rows.append((
+            v['name'], v.get('output_path'), v.get('uniqueness'),
+            v.get('tiktok_score'), v.get('instagram_score'), v.get('youtube_score'),
+            json.dumps(mods) if mods else None,
+            json.dumps(plan, sort_keys=True) if plan else None,
+        ))
+    if replace and session.get('folder_name'):
+        conn.execute(
+            "DELETE FROM sessions WHERE mode=? AND folder_name=?",
+            (session['mode'], session['folder_name'])
         )
-        vid = cur.lastrowid
-        conn.commit()
-        return vid
+    sid = save_session(**session)
+    conn.executemany(
+        """INSERT INTO variations (session_id, name, output_path, uniqueness_score,
+           tiktok_score, instagram_score, youtube_score, modifications_json, plan_json)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(sid, *row) for row in rows]
+    )
+    return sid
+
+
+def get_variation_plan(variation_id):
+    """Resolved parameter plan of a variation (None for rows saved before plans existed)."""
+    with _DBConnection() as conn:
+        row = conn.execute(
+            "SELECT plan_json FROM variations WHERE id=?", (variation_id,)
+        ).fetchone()
+        return json.loads(row['plan_json']) if row and row['plan_json'] else None
 
 
 def get_session_variations(session_id):
@@ -160,35 +551,33 @@ def get_session_variations(session_id):
 
 # ---- Publications ----
 
-def save_publication(post_id, caption, account_ids, platforms,
+@_write_op()
+def save_publication(conn, post_id, caption, account_ids, platforms,
                      variation_id=None, status="processing",
                      scheduled_at=None):
-    with _DBConnection() as conn:
-        cur = conn.execute(
-            """INSERT INTO publications (variation_id, post_id, caption, account_ids_json,
-               platforms_json, status, scheduled_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (variation_id, post_id, caption,
-             json.dumps(account_ids), json.dumps(platforms),
-             status, scheduled_at)
+    cur = conn.execute(
+        """INSERT INTO publications (variation_id, post_id, caption, account_ids_json,
+           platforms_json, status, scheduled_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (variation_id, post_id, caption,
+         json.dumps(account_ids), json.dumps(platforms),
+         status, scheduled_at)
+    )
+    pid = cur.lastrowid
+    return pid
+
+
+@_write_op()
+def update_publication_status(conn, publication_id, status, published_at=None):
+    if published_at:
+        conn.execute(
+            "UPDATE publications SET status=?, published_at=? WHERE id=?",
+            (status, published_at, publication_id)
+        )
+    else:
+        conn.execute(
+            "UPDATE publications SET status=? WHERE id=?", (status, publication_id)
         )
-        pid = cur.lastrowid
-        conn.commit()
-        return pid
-
-
-def update_publication_status(publication_id, status, published_at=None):
-    with _DBConnection() as conn:
-        if published_at:
-            conn.execute(
-                "UPDATE publications SET status=?, published_at=? WHERE id=?",
-                (status, published_at, publication_id)
-            )
-        else:
-            conn.execute(
-                "UPDATE publications SET status=? WHERE id=?", (status, publication_id)
-            )
-        conn.commit()
 
 
 def get_publications(limit=50, status=None):
@@ -207,125 +596,305 @@ def get_publications(limit=50, status=None):
 
 # ---- Publication Results ----
 
-def save_pub_result(publication_id, social_account_id, platform,
+@_write_op()
+def save_pub_result(conn, publication_id, social_account_id, platform,
                     success, post_url=None, platform_post_id=None,
                     username=None, error=None):
+    conn.execute(
+        """INSERT INTO pub_results (publication_id, social_account_id, platform,
+           success, post_url, platform_post_id, username, error_json)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (publication_id, social_account_id, platform, int(success),
+         post_url, platform_post_id, username,
+         json.dumps(error) if error else None)
+    )
+
+
+# ---- Jobs (background generation queue) ----
+
+@_write_op()
+def create_job(conn, kind, batch, name, payload, total=0):
+    cur = conn.execute(
+        """INSERT INTO jobs (kind, batch, name, payload_json, progress_total)
+           VALUES (?, ?, ?, ?, ?)""",
+        (kind, batch, name, json.dumps(payload), total)
+    )
+    jid = cur.lastrowid
+    return jid
+
+
+@_write_op()
+def claim_next_job(conn):
+    """Atomically move the oldest queued job to 'running' and return it (or None)."""
+    row = conn.execute(
+        "SELECT * FROM jobs WHERE status='queued' ORDER BY id LIMIT 1"
+    ).fetchone()
+    if not row:
+        return None
+    conn.execute(
+        "UPDATE jobs SET status='running', started_at=datetime('now') WHERE id=?", (row['id'],)
+    )
+    return dict(row)
+
+
+@_write_op(wait=False)
+def update_job_progress(conn, job_id, done):
+    """`done` counts variations, fractional while an encode is in flight."""
+    conn.execute("UPDATE jobs SET progress_done=? WHERE id=?", (done, job_id))
+
+
+@_write_op()
+def finish_job(conn, job_id, status, result=None, error=None):
+    conn.execute(
+        """UPDATE jobs SET status=?, result_json=?, error=?, finished_at=datetime('now')
+           WHERE id=?""",
+        (status, json.dumps(result) if result is not None else None, error, job_id)
+    )
+
+
+@_write_op()
+def requeue_running_jobs(conn):
+    """Jobs left 'running' by a dead server process go back to the queue."""
+    conn.execute("UPDATE jobs SET status='queued', progress_done=0 WHERE status='running'")
+
+
+@_write_op()
+def requeue_jobs(conn, job_ids):
+    """Put finished/failed jobs back in the queue (resume)."""
+    conn.executemany(
+        """UPDATE jobs SET status='queued', result_json=NULL, error=NULL,
+           started_at=NULL, finished_at=NULL WHERE id=?""",
+        [(jid,) for jid in job_ids]
+    )
+
+
+def get_batch_jobs(batch):
     with _DBConnection() as conn:
-        conn.execute(
-            """INSERT INTO pub_results (publication_id, social_account_id, platform,
-               success, post_url, platform_post_id, username, error_json)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (publication_id, social_account_id, platform, int(success),
-             post_url, platform_post_id, username,
-             json.dumps(error) if error else None)
-        )
-        conn.commit()
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE batch=? ORDER BY id", (batch,)
+        ).fetchall()
+        return [dict(r) for r in rows]
 
 
-# ---- Analytics ----
+def get_finished_batch_jobs(older_than):
+    """Jobs of the batches whose jobs all finished more than `older_than` seconds ago."""
+    with _DBConnection() as conn:
+        rows = conn.execute(
+            """SELECT * FROM jobs WHERE batch IN (
+                   SELECT batch FROM jobs GROUP BY batch
+                   HAVING SUM(status IN ('queued', 'running')) = 0
+                      AND MAX(finished_at) < datetime('now', ?))
+               ORDER BY id""",
+            (f"-{int(older_than)} seconds",)
+        ).fetchall()
+        return [dict(r) for r in rows]
 
-def get_analytics():
+
+def get_active_batches(kind):
+    """Batches of this kind that still have queued or running jobs, newest first."""
     with _DBConnection() as conn:
-        stats = {}
+        rows = conn.execute(
+            """SELECT batch, MAX(id) AS last_id FROM jobs
+               WHERE kind=? AND status IN ('queued', 'running')
+               GROUP BY batch ORDER BY last_id DESC""",
+            (kind,)
+        ).fetchall()
+        return [r['batch'] for r in rows]
+
 
-        # Total sessions
-        stats['total_sessions'] = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+def get_seconds_per_variation(limit=20):
+    """Measured wall time per variation over the last finished jobs (None without history)."""
+    with _DBConnection() as conn:
+        row = conn.execute(
+            """SELECT SUM((julianday(finished_at) - julianday(started_at)) * 86400) AS secs,
+                      SUM(progress_total) AS total
+               FROM (SELECT started_at, finished_at, progress_total FROM jobs
+                     WHERE status='done' AND started_at IS NOT NULL AND progress_total > 0
+                     ORDER BY id DESC LIMIT ?)""",
+            (limit,)
+        ).fetchone()
+        if not row or not row['total']:
+            return None
+        return row['secs'] / row['total']
 
-        # Total variations
-        stats['total_variations'] = conn.execute("SELECT COUNT(*) FROM variations").fetchone()[0]
 
-        # Average uniqueness score
-        row = conn.execute("SELECT AVG(uniqueness_score) FROM variations WHERE uniqueness_score IS NOT NULL").fetchone()
-        stats['avg_uniqueness'] = round(row[0], 1) if row and row[0] else 0
+# ---- Analytics ----
+# analytics_daily holds counters per UTC day plus an all-time row (day='*'), kept up to
+# date by triggers on the base tables: cascade deletes (session replace) are counted too.
+
+# (table, metric, key expr, value expr, condition, extra FROM) — {r} is the row (NEW / OLD / r)
+_ROLLUPS = [
+    ("sessions", "sessions", "{r}.mode", "1", "1", ""),
+    ("variations", "variations", "''", "1", "1", ""),
+    ("variations", "uniq_n", "''", "1", "{r}.uniqueness_score IS NOT NULL", ""),
+    ("variations", "uniq_sum", "''", "{r}.uniqueness_score", "{r}.uniqueness_score IS NOT NULL", ""),
+    ("variations", "safe", "''", "1", "{r}.uniqueness_score >= 60", ""),
+    ("variations", "bucket", """CASE
+        WHEN {r}.uniqueness_score >= 80 THEN '80-100'
+        WHEN {r}.uniqueness_score >= 60 THEN '60-79'
+        WHEN {r}.uniqueness_score >= 40 THEN '40-59'
+        WHEN {r}.uniqueness_score >= 20 THEN '20-39'
+        ELSE '0-19' END""", "1", "{r}.uniqueness_score IS NOT NULL", ""),
+    ("variations", "platform_n", "'tiktok'", "1", "{r}.tiktok_score IS NOT NULL", ""),
+    ("variations", "platform_sum", "'tiktok'", "{r}.tiktok_score", "{r}.tiktok_score IS NOT NULL", ""),
+    ("variations", "platform_n", "'instagram'", "1", "{r}.instagram_score IS NOT NULL", ""),
+    ("variations", "platform_sum", "'instagram'", "{r}.instagram_score", "{r}.instagram_score IS NOT NULL", ""),
+    ("variations", "platform_n", "'youtube'", "1", "{r}.youtube_score IS NOT NULL", ""),
+    ("variations", "platform_sum", "'youtube'", "{r}.youtube_score", "{r}.youtube_score IS NOT NULL", ""),
+    ("variations", "high", "''", "1", "{r}.uniqueness_score >= 70 AND {r}.modifications_json IS NOT NULL", ""),
+    ("variations", "high_mod", "j.key", "1", "{r}.uniqueness_score >= 70",
+     ", json_each(CASE WHEN json_valid({r}.modifications_json) THEN CASE WHEN "
+     "json_type({r}.modifications_json) = 'object' THEN {r}.modifications_json END END) AS j"),
+    ("publications", "publications", "{r}.status", "1", "1", ""),
+    ("pub_results", "pub_results", "CASE WHEN {r}.success THEN 'success' ELSE 'failed' END", "1", "1", ""),
+]
+
+
+def _rollup_sql(spec, r, sign, source=""):
+    _, metric, key, value, cond, extra = spec
+    return (
+        f"INSERT INTO analytics_daily (day, metric, key, value) "
+        f"SELECT CASE WHEN d.all_time THEN '*' ELSE date({r}.created_at) END, '{metric}', {key.format(r=r)}, "
+        f"{sign} * ({value.format(r=r)}) "
+        f"FROM {source}(SELECT 0 AS all_time UNION ALL SELECT 1) AS d{extra.format(r=r)} "
+        f"WHERE {cond.format(r=r)} "
+        f"ON CONFLICT(day, metric, key) DO UPDATE SET value = value + excluded.value;"
+    )
+
+
+def _analytics_schema():
+    sql = ["""
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            key TEXT NOT NULL DEFAULT '',
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric, key)
+        ) WITHOUT ROWID;"""]
+    for table in ("sessions", "variations", "publications", "pub_results"):
+        specs = [spec for spec in _ROLLUPS if spec[0] == table]
+        for event, r, sign in (("INSERT", "NEW", 1), ("DELETE", "OLD", -1)):
+            body = "\n".join(_rollup_sql(spec, r, sign) for spec in specs)
+            sql.append(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_rollup "
+                       f"AFTER {event} ON {table} BEGIN\n{body}\nEND;")
+    # Publication status moves between counters
+    specs = [spec for spec in _ROLLUPS if spec[1] == "publications"]
+    body = "\n".join([_rollup_sql(spec, "OLD", -1) for spec in specs] +
+                     [_rollup_sql(spec, "NEW", 1) for spec in specs])
+    sql.append("CREATE TRIGGER IF NOT EXISTS trg_publications_status_rollup "
+               "AFTER UPDATE OF status ON publications WHEN OLD.status IS NOT NEW.status "
+               f"BEGIN\n{body}\nEND;")
+    return "\n".join(sql)
+
+
+@_write_op()
+def rebuild_analytics(conn):
+    """Recompute analytics_daily from the base tables (first run on an existing db, or repair)."""
+    conn.execute("DELETE FROM analytics_daily")
+    for spec in _ROLLUPS:
+        conn.execute(_rollup_sql(spec, "r", 1, source=f"{spec[0]} AS r CROSS JOIN "))
+
+
+def _day(d):
+    return d if isinstance(d, str) else d.isoformat()
+
+
+def get_mod_breakdown(mod, step=None, intensity=None):
+    """Score by value bucket of one modification, over the whole history:
+    [{bucket, n, avg_uniqueness, safe_rate}]. mod: a MOD_COLUMNS key."""
+    _, default_step = MOD_COLUMNS[mod]
+    step = step or default_step
+    col = f"v.mod_{mod}"
+    sql = f"""SELECT ROUND({col} / ?) * ? AS bucket, COUNT(*) AS n,
+                     AVG(v.uniqueness_score) AS avg_uniqueness,
+                     AVG(v.uniqueness_score >= 60) * 100 AS safe_rate
+              FROM variations v"""
+    args = [step, step]
+    if intensity:
+        sql += " JOIN sessions s ON s.id = v.session_id WHERE s.intensity = ? AND"
+        args.append(intensity)
+    else:
+        # The planner prefers a table scan (re-extracting the JSON of every row) over this index
+        sql += f" INDEXED BY idx_variations_mod_{mod} WHERE"
+    sql += f" {col} IS NOT NULL GROUP BY bucket ORDER BY bucket"
+    with _DBConnection() as conn:
+        return [{
+            "bucket": round(r["bucket"], 4), "n": r["n"],
+            "avg_uniqueness": round(r["avg_uniqueness"], 1) if r["avg_uniqueness"] is not None else None,
+            "safe_rate": round(r["safe_rate"], 1) if r["safe_rate"] is not None else None,
+        } for r in conn.execute(sql, args).fetchall()]
 
-        # Safe count (>=60)
-        stats['safe_count'] = conn.execute(
-            "SELECT COUNT(*) FROM variations WHERE uniqueness_score >= 60"
-        ).fetchone()[0]
 
-        # Total publications
-        stats['total_publications'] = conn.execute("SELECT COUNT(*) FROM publications").fetchone()[0]
+def get_analytics(start=None, end=None):
+    """Dashboard stats read from the rollups. start / end: optional inclusive days
+    ('YYYY-MM-DD' or date); without them the all-time counters are used."""
+    with _DBConnection() as conn:
+        if start is None and end is None:
+            rows = conn.execute(
+                "SELECT metric, key, value FROM analytics_daily WHERE day='*'"
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                """SELECT metric, key, SUM(value) AS value FROM analytics_daily
+                   WHERE day BETWEEN ? AND ? GROUP BY metric, key""",
+                (_day(start or "0000-01-01"), _day(end or "9999-12-31"))
+            ).fetchall()
+        roll = {}
+        for r in rows:
+            if r['value']:
+                roll.setdefault(r['metric'], {})[r['key']] = r['value']
 
-        # Successful publications
-        stats['successful_publications'] = conn.execute(
-            "SELECT COUNT(*) FROM pub_results WHERE success=1"
-        ).fetchone()[0]
+        def total(metric, key=''):
+            return roll.get(metric, {}).get(key, 0)
 
-        # Failed publications
-        stats['failed_publications'] = conn.execute(
-            "SELECT COUNT(*) FROM pub_results WHERE success=0"
-        ).fetchone()[0]
+        def count(metric):
+            return {k: int(v) for k, v in roll.get(metric, {}).items()}
 
-        # Publications by status
+        stats = {}
+        stats['total_sessions'] = int(sum(roll.get('sessions', {}).values()))
+        stats['total_variations'] = int(total('variations'))
+        uniq_n = total('uniq_n')
+        stats['avg_uniqueness'] = round(total('uniq_sum') / uniq_n, 1) if uniq_n else 0
+        stats['safe_count'] = int(total('safe'))
+
+        pubs = count('publications')
+        stats['total_publications'] = sum(pubs.values())
+        stats['successful_publications'] = int(total('pub_results', 'success'))
+        stats['failed_publications'] = int(total('pub_results', 'failed'))
         for s in ['posted', 'scheduled', 'processing']:
-            stats[f'pub_{s}'] = conn.execute(
-                "SELECT COUNT(*) FROM publications WHERE status=?", (s,)
-            ).fetchone()[0]
+            stats[f'pub_{s}'] = pubs.get(s, 0)
 
-        # Sessions by mode
-        modes = conn.execute(
-            "SELECT mode, COUNT(*) as cnt FROM sessions GROUP BY mode ORDER BY cnt DESC"
-        ).fetchall()
-        stats['sessions_by_mode'] = {r['mode']: r['cnt'] for r in modes}
-
-        # Score distribution
-        buckets = conn.execute("""
-            SELECT
-                CASE
-                    WHEN uniqueness_score >= 80 THEN '80-100'
-                    WHEN uniqueness_score >= 60 THEN '60-79'
-                    WHEN uniqueness_score >= 40 THEN '40-59'
-                    WHEN uniqueness_score >= 20 THEN '20-39'
-                    ELSE '0-19'
-                END as bucket,
-                COUNT(*) as cnt
-            FROM variations WHERE uniqueness_score IS NOT NULL
-            GROUP BY bucket ORDER BY bucket DESC
-        """).fetchall()
-        stats['score_distribution'] = {r['bucket']: r['cnt'] for r in buckets}
-
-        # Average scores by platform
-        row = conn.execute("""
-            SELECT AVG(tiktok_score), AVG(instagram_score), AVG(youtube_score)
-            FROM variations
-            WHERE tiktok_score IS NOT NULL
-        """).fetchone()
-        if row:
-            stats['avg_tiktok'] = round(row[0], 1) if row[0] else None
-            stats['avg_instagram'] = round(row[1], 1) if row[1] else None
-            stats['avg_youtube'] = round(row[2], 1) if row[2] else None
-        else:
-            stats['avg_tiktok'] = None
-            stats['avg_instagram'] = None
-            stats['avg_youtube'] = None
+        stats['sessions_by_mode'] = dict(sorted(count('sessions').items(), key=lambda x: -x[1]))
+        stats['score_distribution'] = dict(sorted(count('bucket').items(), reverse=True))
+
+        for platform in ('tiktok', 'instagram', 'youtube'):
+            n = total('platform_n', platform)
+            stats[f'avg_{platform}'] = round(total('platform_sum', platform) / n, 1) if n else None
+
+        # Which mods appear in high-score variations (>=70), over every such variation
+        stats['high_score_count'] = int(total('high'))
+        stats['high_score_mod_counts'] = count('high_mod')
 
         # Recent sessions (last 10)
+        where, args = [], []
+        if start is not None:
+            where.append("created_at >= ?")
+            args.append(_day(start))
+        if end is not None:
+            where.append("created_at < date(?, '+1 day')")
+            args.append(_day(end))
         stats['recent_sessions'] = [dict(r) for r in conn.execute(
-            "SELECT * FROM sessions ORDER BY created_at DESC LIMIT 10"
+            "SELECT * FROM sessions" + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY created_at DESC LIMIT 10", args
         ).fetchall()]
 
-        # Modification effectiveness (which mods are used in high-score variations)
-        high_score_mods = conn.execute("""
-            SELECT modifications_json FROM variations
-            WHERE uniqueness_score >= 70 AND modifications_json IS NOT NULL
-            ORDER BY uniqueness_score DESC LIMIT 50
-        """).fetchall()
-        mod_samples = []
-        for r in high_score_mods:
-            if r[0]:
-                try:
-                    mod_samples.append(json.loads(r[0]))
-                except (json.JSONDecodeError, TypeError):
-                    pass
-        stats['high_score_mod_samples'] = mod_samples
-
-        # Publications timeline (last 30 days)
-        stats['pub_timeline'] = [dict(r) for r in conn.execute("""
-            SELECT DATE(created_at) as day, COUNT(*) as cnt, status
-            FROM publications
-            WHERE created_at >= datetime('now', '-30 days')
-            GROUP BY day, status
-            ORDER BY day
-        """).fetchall()]
+        # Publications timeline (last 30 days, or the requested range)
+        since = _day(start) if start else conn.execute("SELECT date('now', '-30 days')").fetchone()[0]
+        stats['pub_timeline'] = [dict(r) for r in conn.execute(
+            """SELECT day, CAST(value AS INTEGER) AS cnt, key AS status FROM analytics_daily
+               WHERE metric='publications' AND value != 0 AND day BETWEEN ? AND ?
+               ORDER BY day""",
+            (since, _day(end or "9999-12-31"))
+        ).fetchall()]
 
         return stats
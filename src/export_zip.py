@@ -0,0 +1,65 @@
+"""
+Export ZIP — archives ZIP_STORED ecrites en streaming dans le dossier de sortie
+Les MP4 ne se compressent pas : stocker evite le deflate et la copie en memoire.
+Le nom de l'archive contient une cle (arcname, chemin, taille, mtime) des entrees :
+meme selection de fichiers inchanges → archive deja sur disque, rien a reconstruire.
+"""
+import os
+import re
+import zipfile
+import hashlib
+
+
+def _entries_key(entries):
+    h = hashlib.sha1()
+    for arcname, path in sorted(entries):
+        st = os.stat(path)
+        h.update(f"{arcname}\0{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:12]
+
+
+def _drop_stale(out_dir, base_name, keep):
+    """Supprime les archives de la meme serie construites pour une autre selection."""
+    pattern = re.compile(re.escape(base_name) + r"\.[0-9a-f]{12}\.zip")
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if pattern.fullmatch(name) and path != keep:
+            try: os.unlink(path)
+            except OSError: pass
+
+
+def _target(entries, out_dir, base_name):
+    entries = [(arcname, path) for arcname, path in entries if path and os.path.exists(path)]
+    if not entries:
+        return entries, None
+    return entries, os.path.join(out_dir, f"{base_name}.{_entries_key(entries)}.zip")
+
+
+def built_zip(entries, out_dir, base_name):
+    """Chemin de l'archive deja ecrite pour ces fichiers inchanges, sinon None (ne construit rien)."""
+    _, path = _target(entries, out_dir, base_name)
+    return path if path and os.path.exists(path) else None
+
+
+def build_zip(entries, out_dir, base_name):
+    """entries: [(nom dans l'archive, chemin)]. Ecrit <out_dir>/<base_name>.<cle>.zip
+    (sauf s'il existe deja) et retourne son chemin, ou None si aucune entree n'existe."""
+    entries, path = _target(entries, out_dir, base_name)
+    if not path:
+        return None
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = path + ".tmp"
+    try:
+        # ZipFile.write copies each file in chunks: nothing is held in memory
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for arcname, src in entries:
+                zf.write(src, arcname)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    _drop_stale(out_dir, base_name, path)
+    return path
@@ -0,0 +1,301 @@
+"""
+Job Engine — generation Bulk / Ferme en arriere-plan, independante de la session Streamlit
+File de jobs persistee dans tikfusion.db ; un thread dispatcher alimente un pool de process.
+Un refresh navigateur ou une coupure websocket n'interrompt plus l'encodage.
+"""
+import os
+import json
+import time
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from database import (
+    create_job, claim_next_job, update_job_progress, finish_job,
+    requeue_running_jobs, requeue_jobs, get_batch_jobs, get_finished_batch_jobs, init_db,
+    save_session_with_variations, write, flush_writes, optimize_db,
+)
+from run_manifest import load_manifest, save_manifest, new_manifest, record_variation, valid_variations
+from output_catalog import catalog_add
+
+# Jobs encoded at the same time. Each job already spreads its ffmpeg
+# processes over every core (encode_budget), so one is usually enough.
+JOB_PROCESSES = max(1, int(os.environ.get("TIKFUSION_JOB_PROCESSES", "1") or 1))
+
+# Minimum seconds between two progress writes of a job
+PROGRESS_WRITE_INTERVAL = 1.0
+
+# Uploaded sources are copied here for the jobs (see submit_batch_jobs in app.py)
+SOURCE_DIR = os.path.join(tempfile.gettempdir(), "tikfusion_sources")
+# A source kept for a resume is deleted once its batch has been finished this long
+SOURCE_TTL = 2 * 24 * 3600
+# Minimum seconds between two cleanup_sources() passes of the dispatcher
+SOURCE_CLEANUP_INTERVAL = 3600
+
+
+def planned_count(payload):
+    """Variations reellement produites par le job : des plans importes plus courts que `count` le bornent."""
+    count = payload.get("count", 0)
+    if payload.get("plans"):
+        count = min(count, len(payload["plans"]))
+    return count
+
+
+def run_variation_job(job_id, payload):
+    """Execute dans un process du pool : planifie + encode toutes les variations d'une source.
+    Checkpoint dans le manifest du dossier : une reprise n'encode que les Vxx.mp4 manquants ou abimes."""
+    from uniquifier import (
+        VariationPlanner, uniquify_batch_ffmpeg, estimate_uniqueness, plans_from_json, side_output_files,
+    )
+
+    # Effective count first: the resume check below must compare against it, not payload["count"]
+    count = planned_count(payload)
+    folder = payload["output_folder"]
+    os.makedirs(folder, exist_ok=True)
+
+    manifest = load_manifest(folder)
+    if manifest and len(manifest["plans"]) == count:
+        # Resume: keep the original plans so the variations stay diverse as a set
+        plans = plans_from_json(manifest["plans"])
+    else:
+        if payload.get("plans"):
+            plans = plans_from_json(payload["plans"])[:count]
+        else:
+            plans = VariationPlanner(payload["intensity"], payload["enabled_mods"],
+                                     seed=payload.get("seed")).plan(count)
+        manifest = new_manifest(payload["input_path"], plans)
+        save_manifest(folder, manifest)
+
+    names = [f"V{i+1:02d}" for i in range(count)]
+    outputs = [os.path.join(folder, f"{n}.mp4") for n in names]
+    finished = valid_variations(folder, manifest)
+    todo = [i for i, n in enumerate(names) if n not in finished]
+    fractions = [0.0 if i in todo else 1.0 for i in range(count)]
+    last_write = 0.0
+
+    def _write_progress(force=False):
+        nonlocal last_write
+        now = time.monotonic()
+        if not force and now - last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        last_write = now
+        try:
+            update_job_progress(job_id, round(sum(fractions), 2))
+        except Exception:
+            pass  # progress is best effort — never stop an encode for it
+
+    errors = []
+    side_errors = []  # thumbnail / previews only: the variation itself is fine
+
+    def _on_progress(k, fraction):
+        fractions[todo[k]] = fraction
+        _write_progress()
+
+    def _on_result(k, r):
+        i = todo[k]
+        fractions[i] = 1.0
+        if r.get("success") and os.path.exists(outputs[i]):
+            mods = r.get("modifications", {})
+            record_variation(folder, manifest, names[i], outputs[i], r.get("plan"), mods,
+                             estimate_uniqueness(mods)['uniqueness'])
+            try:
+                catalog_add([outputs[i]])
+            except Exception:
+                pass  # the Stats reconcile scan picks it up anyway
+            finished[names[i]] = manifest["variations"][names[i]]
+            if r.get("side_error"):
+                side_errors.append(f"{names[i]}: {r['side_error'][:150]}")
+        else:
+            errors.append(f"{names[i]}: {(r.get('error') or 'unknown')[:150]}")
+        _write_progress(force=True)
+
+    _write_progress(force=True)
+    try:
+        if todo:
+            if not os.path.exists(payload["input_path"]):
+                raise FileNotFoundError(f"Source introuvable: {payload['input_path']}")
+            uniquify_batch_ffmpeg(payload["input_path"], [outputs[i] for i in todo], [plans[i] for i in todo],
+                                  workers=payload.get("workers") or None, on_result=_on_result,
+                                  segmented=payload.get("segmented", False), on_progress=_on_progress,
+                                  thumbnails=True)
+    finally:
+        # Progress / catalog writes are queued without waiting: commit them before returning
+        flush_writes(timeout=60)
+
+    variations = [{
+        'name': n, 'output_path': outputs[i],
+        'uniqueness': finished[n]['uniqueness'], 'modifications': finished[n]['modifications'],
+        'plan': finished[n]['plan'], **side_output_files(outputs[i]),
+    } for i, n in enumerate(names) if n in finished]
+
+    # Keep the source while something is left to resume
+    if payload.get("cleanup_input") and not errors:
+        try: os.unlink(payload["input_path"])
+        except OSError: pass
+
+    return {'name': payload["name"], 'variations': variations,
+            'success_count': len(variations), 'errors': errors, 'side_errors': side_errors}
+
+
+def _persist_job_result(job, result):
+    """Une session par source (mode bulk / farm). Une reprise remplace la session precedente."""
+    if not result['variations']:
+        return
+    payload = json.loads(job["payload_json"])
+    save_session_with_variations(
+        {"mode": job["kind"], "folder_name": f"{job['batch']}/{result['name']}",
+         "num_variations": planned_count(payload), "intensity": payload.get("intensity", "medium")},
+        result['variations'], replace=True,
+    )
+
+
+def cleanup_sources(ttl=SOURCE_TTL):
+    """Supprime les copies de sources (SOURCE_DIR) des batches termines depuis plus de ttl :
+    gardees pour une reprise (variations en echec), elles ne sont jamais reprises ensuite."""
+    removed = 0
+    for job in get_finished_batch_jobs(ttl):
+        path = json.loads(job["payload_json"]).get("input_path")
+        # Only our own copies, never a file the user pointed at
+        if not path or os.path.dirname(os.path.abspath(path)) != SOURCE_DIR:
+            continue
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def resumable_jobs(batch):
+    """Jobs du batch a reprendre : en erreur, ou termines avec des variations manquantes."""
+    ids = []
+    for j in get_batch_jobs(batch):
+        if j["status"] == "error":
+            ids.append(j["id"])
+        elif j["status"] == "done" and j["result_json"] and json.loads(j["result_json"]).get("errors"):
+            ids.append(j["id"])
+    return ids
+
+
+class JobEngine:
+    """Dispatcher + pool de process. Une instance par serveur (st.cache_resource)."""
+
+    def __init__(self, processes=None, poll_interval=1.0):
+        init_db()
+        self.processes = processes or JOB_PROCESSES
+        self.poll_interval = poll_interval
+        self._pool = self._new_pool()
+        self._running = {}  # future -> job row
+        self._stop = threading.Event()
+        self._last_cleanup = None
+
+        # Jobs interrupted by a previous server process resume from their manifest
+        requeue_running_jobs()
+
+        self._thread = threading.Thread(target=self._dispatch_loop, name="tikfusion-jobs", daemon=True)
+        self._thread.start()
+
+    def _new_pool(self):
+        # spawn: never fork the multi-threaded Streamlit server
+        return ProcessPoolExecutor(max_workers=self.processes,
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, kind, batch, name, payload):
+        """Met un job en file ; il demarre des qu'un process est libre."""
+        return create_job(kind, batch, name, payload, total=planned_count(payload))
+
+    def resume(self, batch):
+        """Remet en file les jobs incomplets du batch ; les sorties deja valides sont sautees."""
+        ids = resumable_jobs(batch)
+        requeue_jobs(ids)
+        return len(ids)
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._reap()
+                while len(self._running) < self.processes:
+                    job = claim_next_job()
+                    if not job:
+                        break
+                    self._start(job)
+                optimize_db()
+                self._cleanup_sources()
+            except Exception:
+                pass  # keep dispatching — a DB hiccup must not kill the engine
+            self._stop.wait(self.poll_interval)
+
+    def _cleanup_sources(self):
+        now = time.monotonic()
+        if self._last_cleanup is None or now - self._last_cleanup >= SOURCE_CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            cleanup_sources()
+
+    def _start(self, job):
+        payload = json.loads(job["payload_json"])
+        try:
+            future = self._pool.submit(run_variation_job, job["id"], payload)
+        except BrokenProcessPool:
+            self._pool = self._new_pool()
+            future = self._pool.submit(run_variation_job, job["id"], payload)
+        self._running[future] = job
+
+    def _reap(self):
+        for future in [f for f in self._running if f.done()]:
+            job = self._running.pop(future)
+            try:
+                self._finish(job, future)
+            except Exception:
+                self._running[future] = job  # database unavailable: retry on the next pass
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            finish_job(job["id"], "error", error=str(e)[:500])
+            return
+        # Job status + session/variations land in the same commit
+        def _done(conn):
+            finish_job(job["id"], "done", result=result)
+            _persist_job_result(job, result)
+        try:
+            write(_done)
+        except Exception as e:
+            # The rollback undid finish_job too: record the failure, or the batch never finishes
+            finish_job(job["id"], "error", error=f"Enregistrement impossible: {str(e)[:450]}")
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_utc(ts):
+    try:
+        return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def batch_status(batch):
+    """Etat agrege d'un batch (Bulk ou Ferme) pour l'affichage."""
+    jobs = get_batch_jobs(batch)
+    started = [t for t in (_parse_utc(j["started_at"]) for j in jobs) if t]
+    elapsed = (datetime.now(timezone.utc) - min(started)).total_seconds() if started else 0
+    results = []
+    for j in jobs:
+        if j["status"] == "done" and j["result_json"]:
+            results.append(json.loads(j["result_json"]))
+    return {
+        "jobs": len(jobs),
+        "done": sum(j["progress_done"] or 0 for j in jobs),
+        "total": sum(j["progress_total"] or 0 for j in jobs),
+        "finished": bool(jobs) and all(j["status"] in ("done", "error") for j in jobs),
+        "running": [j["name"] for j in jobs if j["status"] == "running"],
+        "elapsed": elapsed,
+        "results": results,
+        "errors": [f"{j['name']}: {j['error']}" for j in jobs if j["status"] == "error"],
+    }
@@ -0,0 +1,265 @@
+"""
+Media Probe — un seul ffprobe (JSON) par fichier, memoise en memoire + cache disque
+Cle de cache: (chemin absolu, taille, mtime). Un fichier modifie est re-probe.
+"""
+import subprocess
+import sqlite3
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional
+
+PROBE_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "probe_cache.db")
+
+# Seconds of packets read to estimate the keyframe interval (keeps the probe cheap)
+KEYFRAME_SCAN_SECONDS = 10
+
+
+@dataclass
+class MediaInfo:
+    path: str
+    duration: Optional[float]
+    width: Optional[int]
+    height: Optional[int]
+    video_codec: Optional[str]
+    audio_codec: Optional[str]
+    sample_rate: Optional[int]
+    fps: Optional[float]
+    rotation: int = 0
+    keyframe_interval: Optional[float] = None
+    # Keyframe timestamps of the whole video stream, filled on demand by keyframe_times()
+    keyframes: Optional[List[float]] = None
+    streams: List[Dict] = field(default_factory=list)
+    format: Dict = field(default_factory=dict)
+
+    @property
+    def has_audio(self):
+        return any(s.get('codec_type') == 'audio' for s in self.streams)
+
+    @property
+    def has_video(self):
+        return any(s.get('codec_type') == 'video' for s in self.streams)
+
+    def as_ffprobe_dict(self):
+        """Format brut ffprobe ({'format': ..., 'streams': ...})"""
+        return {"format": self.format, "streams": self.streams}
+
+
+# In-memory entries kept (least recently used dropped first); the disk cache keeps the rest
+MEMO_SIZE = 256
+
+_memo = OrderedDict()
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _cache_key(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def _disk():
+    """Connexion au cache disque du thread appelant, ouverte au premier usage puis reutilisee."""
+    key = (PROBE_CACHE_PATH, os.getpid())
+    if getattr(_local, "key", None) != key:
+        conn = sqlite3.connect(PROBE_CACHE_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS probe_cache (
+            path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)""")
+        conn.commit()
+        _local.conn = conn
+        _local.key = key
+    return _local.conn
+
+
+def _disk_get(key):
+    try:
+        row = _disk().execute(
+            "SELECT data FROM probe_cache WHERE path=? AND size=? AND mtime_ns=?", key
+        ).fetchone()
+        return MediaInfo(**json.loads(row[0])) if row else None
+    except (sqlite3.Error, TypeError, ValueError):
+        return None
+
+
+def _disk_put(key, info):
+    try:
+        conn = _disk()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO probe_cache (path, size, mtime_ns, data) VALUES (?, ?, ?, ?)",
+                (*key, json.dumps(asdict(info)))
+            )
+    except sqlite3.Error:
+        pass
+
+
+def _memo_get(key):
+    with _lock:
+        info = _memo.get(key)
+        if info is not None:
+            _memo.move_to_end(key)
+        return info
+
+
+def _memo_put(key, info):
+    with _lock:
+        _memo[key] = info
+        _memo.move_to_end(key)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def _parse_rate(rate):
+    """'30000/1001' -> 29.97"""
+    try:
+        num, den = rate.split('/')
+        return round(int(num) / int(den), 3) if int(den) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def _rotation(stream):
+    try:
+        rotate = stream.get('tags', {}).get('rotate')
+        if rotate is not None:
+            return int(rotate) % 360
+        for sd in stream.get('side_data_list', []):
+            if 'rotation' in sd:
+                return int(sd['rotation']) % 360
+    except (TypeError, ValueError):
+        pass
+    return 0
+
+
+def _keyframe_interval(packets, video_index):
+    times = []
+    for p in packets:
+        if p.get('stream_index') == video_index and 'K' in p.get('flags', ''):
+            try:
+                times.append(float(p['pts_time']))
+            except (KeyError, TypeError, ValueError):
+                continue
+    times.sort()
+    if len(times) < 2:
+        return None
+    gaps = [b - a for a, b in zip(times, times[1:]) if b > a]
+    return round(sum(gaps) / len(gaps), 3) if gaps else None
+
+
+def _run_ffprobe(path):
+    from uniquifier import FFPROBE_BIN
+
+    if not FFPROBE_BIN:
+        return None
+    cmd = [
+        FFPROBE_BIN, "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams",
+        "-show_entries", "packet=stream_index,pts_time,flags",
+        "-read_intervals", f"%+{KEYFRAME_SCAN_SECONDS}",
+        path
+    ]
+    try:
+        r = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if r.returncode != 0:
+            return None
+        data = json.loads(r.stdout or "{}")
+    except Exception:
+        return None
+
+    streams = data.get('streams', [])
+    fmt = data.get('format', {})
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    try:
+        duration = float(fmt.get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    try:
+        sample_rate = int(audio['sample_rate']) if audio else None
+    except (KeyError, TypeError, ValueError):
+        sample_rate = None
+
+    return MediaInfo(
+        path=path,
+        duration=duration,
+        width=video.get('width') if video else None,
+        height=video.get('height') if video else None,
+        video_codec=video.get('codec_name') if video else None,
+        audio_codec=audio.get('codec_name') if audio else None,
+        sample_rate=sample_rate,
+        fps=_parse_rate(video.get('avg_frame_rate')) if video else None,
+        rotation=_rotation(video) if video else 0,
+        keyframe_interval=_keyframe_interval(data.get('packets', []), video.get('index')) if video else None,
+        streams=streams,
+        format=fmt,
+    )
+
+
+def probe(path):
+    """MediaInfo du fichier (None si ffprobe indisponible ou fichier illisible).
+    Memoise par (path, size, mtime) en memoire (LRU, MEMO_SIZE entrees) puis sur disque."""
+    try:
+        key = _cache_key(path)
+    except OSError:
+        return None
+
+    info = _memo_get(key)
+    if info is not None:
+        return info
+
+    info = _disk_get(key)
+    if info is None:
+        info = _run_ffprobe(path)
+        if info is None:
+            return None  # failures are not cached
+        _disk_put(key, info)
+
+    _memo_put(key, info)
+    return info
+
+
+def _scan_keyframes(path):
+    from uniquifier import FFPROBE_BIN
+
+    if not FFPROBE_BIN:
+        return None
+    # Only keyframes are decoded: one pass over the whole file, cheap next to an encode
+    cmd = [
+        FFPROBE_BIN, "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+        "-show_entries", "frame=pts_time", "-of", "csv=p=0", path
+    ]
+    try:
+        r = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        if r.returncode != 0:
+            return None
+    except Exception:
+        return None
+    times = set()
+    for line in r.stdout.splitlines():
+        try:
+            times.add(round(float(line.strip().strip(',')), 3))
+        except ValueError:
+            continue  # N/A
+    return sorted(times)
+
+
+def keyframe_times(path):
+    """Timestamps (s) des vraies keyframes du flux video, [] si inconnues.
+    Scan complet fait une seule fois, puis garde avec le reste du MediaInfo (memoire + disque)."""
+    info = probe(path)
+    if info is None:
+        return []
+    if info.keyframes is None:
+        keyframes = _scan_keyframes(path)
+        if keyframes is None:
+            return []  # failures are not cached
+        info.keyframes = keyframes
+        try:
+            _disk_put(_cache_key(path), info)
+        except OSError:
+            pass
+    return info.keyframes
@@ -0,0 +1,185 @@
+"""
+Media Server — sert les videos / archives depuis le disque, sans charger leurs octets en session
+publish(path) cree un lien dur sous media_links/<jeton>/ (jeton HMAC, cle locale) ; un petit serveur
+tornado (thread, MEDIA_HOST:MEDIA_PORT, local par defaut) le sert par morceaux avec requetes Range,
+le bon type MIME et sans limite de taille.
+prune_if_due() retire regulierement les liens expires ou dont la sortie a ete supprimee.
+"""
+import os
+import time
+import shutil
+import hmac
+import hashlib
+import secrets
+import threading
+from urllib.parse import quote
+
+MEDIA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "media_links")
+
+# Port of the media route (same host as the Streamlit page)
+MEDIA_PORT = int(os.environ.get("TIKFUSION_MEDIA_PORT", "8599") or 8599)
+# Interface the route listens on: local only unless opted in (e.g. 0.0.0.0 for a LAN farm)
+MEDIA_HOST = os.environ.get("TIKFUSION_MEDIA_HOST", "127.0.0.1") or "127.0.0.1"
+# Public base URL of the route when the page sits behind a proxy / https (e.g. https://host/media)
+MEDIA_BASE_URL = os.environ.get("TIKFUSION_MEDIA_URL", "").rstrip("/")
+
+# Without the media route, files above this are not offered as an in-session download
+MAX_INLINE_SIZE = 200 * 1024 * 1024
+
+# Published links older than this are removed by prune()
+MEDIA_TTL = 7 * 24 * 3600
+# Minimum seconds between two prune() passes of prune_if_due()
+PRUNE_INTERVAL = 600
+
+# Per-install token key, kept in MEDIA_DIR
+SECRET_FILE = ".secret"
+
+_LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+_lock = threading.Lock()
+_server = None      # None: not started yet, False: unavailable, else the serving thread
+_last_prune = None
+_key = None
+
+
+def _secret():
+    """Cle propre a l'installation (creee au premier usage) : les jetons ne se devinent pas."""
+    global _key
+    if _key is None:
+        _key = _read_secret()
+    return _key
+
+
+def _read_secret():
+    path = os.path.join(MEDIA_DIR, SECRET_FILE)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+    except FileExistsError:
+        pass  # created by another process meanwhile
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _token(path, st):
+    key = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}"
+    return hmac.new(_secret(), key.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def publish(path):
+    """Chemin '<jeton>/<nom>' servant `path` sur la route media, ou None (absent, autre systeme de fichiers)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    token = _token(path, st)
+    name = os.path.basename(path)
+    dest = os.path.join(MEDIA_DIR, token, name)
+    if not os.path.exists(dest):
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            # Hard link, not a copy: no extra disk, and it stays inside the served root
+            os.link(path, dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+    return f"{token}/{quote(name)}"
+
+
+def prune(max_age=MEDIA_TTL):
+    """Retire les liens publies depuis plus de max_age secondes, et ceux dont la sortie a ete
+    supprimee (st_nlink == 1 : le lien est la derniere reference, il garde seul l'espace disque)."""
+    if not os.path.isdir(MEDIA_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for token in os.listdir(MEDIA_DIR):
+        path = os.path.join(MEDIA_DIR, token)
+        if not os.path.isdir(path):
+            continue  # the secret
+        try:
+            orphan = any(entry.stat().st_nlink <= 1 for entry in os.scandir(path) if entry.is_file())
+            if orphan or os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def prune_if_due():
+    """prune() au plus une fois par PRUNE_INTERVAL (appele a chaque URL publiee)."""
+    global _last_prune
+    now = time.monotonic()
+    with _lock:
+        if _last_prune is not None and now - _last_prune < PRUNE_INTERVAL:
+            return 0
+        _last_prune = now
+    return prune()
+
+
+def start_server(port=MEDIA_PORT):
+    """Demarre la route media une fois par process. False si tornado manque ou si le port est pris."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = _start(port)
+        return _server is not False
+
+
+def _start(port):
+    try:
+        import asyncio
+        import tornado.web
+        from tornado.httpserver import HTTPServer
+        from tornado.netutil import bind_sockets
+    except ImportError:
+        return False
+
+    class MediaHandler(tornado.web.StaticFileHandler):
+        # StaticFileHandler: chunked reads, Range requests, Content-Type from the extension
+
+        def set_extra_headers(self, path):
+            self.set_header("Cache-Control", "private, max-age=3600")
+            if self.get_argument("dl", None):
+                # Cross-origin page: the <a download> attribute is ignored, ask for a download here
+                self.set_header("Content-Disposition",
+                                f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}")
+
+    try:
+        sockets = bind_sockets(port, address=MEDIA_HOST)
+    except OSError:
+        return False
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    app = tornado.web.Application([(r"/media/([0-9a-f]+/[^/]+)", MediaHandler, {"path": MEDIA_DIR})])
+
+    def _run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        HTTPServer(app).add_sockets(sockets)
+        loop.run_forever()
+
+    thread = threading.Thread(target=_run, name="tikfusion-media", daemon=True)
+    thread.start()
+    return thread
+
+
+def media_base_url(host):
+    """Base des URLs media vue du navigateur : TIKFUSION_MEDIA_URL, sinon http://<hote de la page>:MEDIA_PORT."""
+    if MEDIA_BASE_URL:
+        return MEDIA_BASE_URL
+    if not host:
+        return None
+    hostname = host.rsplit(":", 1)[0] if not host.endswith("]") else host
+    if MEDIA_HOST in _LOCAL_HOSTS and hostname.strip("[]") not in _LOCAL_HOSTS:
+        return None  # remote browser, local-only route: fall back to the download button
+    return f"http://{hostname}:{MEDIA_PORT}/media"
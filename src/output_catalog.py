@@ -0,0 +1,153 @@
+"""
+Output Catalog — index des videos de sortie dans tikfusion.db (onglet Stats)
+Les generateurs enregistrent chaque fichier ecrit (catalog_add) ; reconcile() ne relit que les
+dossiers dont le mtime a change (ajout / suppression faits a la main), les autres coutent un stat().
+"""
+import os
+import time
+import threading
+
+from database import get_db, write
+
+VIDEO_EXTS = (".mp4",)
+
+# Minimum seconds between two reconcile scans of the same root (Stats renders on every rerun)
+RECONCILE_INTERVAL = 30
+
+_last_scan = {}
+_lock = threading.Lock()
+
+
+def _subtree(path):
+    """Bornes [path/, path0) : tout le sous-arbre en un range scan sur la cle primaire."""
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
+
+def catalog_add(paths):
+    """Enregistre (ou met a jour) des fichiers qui viennent d'etre ecrits."""
+    rows = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        path = os.path.abspath(path)
+        rows.append((path, os.path.dirname(path), st.st_size, st.st_mtime_ns))
+    if not rows:
+        return
+    def _catalog_add(conn):
+        conn.executemany(
+            "INSERT OR REPLACE INTO catalog_files (path, dir, size, mtime_ns) VALUES (?, ?, ?, ?)", rows
+        )
+    # Fire and forget: called from encode workers (a failure is logged by write())
+    write(_catalog_add, wait=False)
+
+
+def _forget(conn, path):
+    lo, hi = _subtree(path)
+    conn.execute("DELETE FROM catalog_files WHERE path >= ? AND path < ?", (lo, hi))
+    conn.execute("DELETE FROM catalog_dirs WHERE path = ? OR (path >= ? AND path < ?)", (path, lo, hi))
+
+
+def reconcile(root, force=False):
+    """Remet le catalogue de `root` en phase avec le disque. Un dossier dont le mtime n'a pas
+    bouge n'est pas relu (ses sous-dossiers connus sont seulement stat()). Retourne True si scanne."""
+    root = os.path.abspath(root)
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_scan.get(root, -RECONCILE_INTERVAL) < RECONCILE_INTERVAL:
+            return False
+        _last_scan[root] = now
+
+    lo, hi = _subtree(root)
+    rows = get_db().execute(
+        "SELECT path, parent, mtime_ns FROM catalog_dirs WHERE path = ? OR (path >= ? AND path < ?)",
+        (root, lo, hi)
+    ).fetchall()
+    known = {r['path']: r['mtime_ns'] for r in rows}
+    children = {}
+    for r in rows:
+        children.setdefault(r['parent'], []).append(r['path'])
+
+    # Walk first, then hand the changes to the writer in one transaction
+    gone, rescanned = [], []  # rescanned: (dir, mtime_ns, [file rows])
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except OSError:
+            gone.append(d)
+            continue
+        if known.get(d) == mtime:
+            stack.extend(children.get(d, []))
+            continue
+
+        files, subdirs = [], []
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(VIDEO_EXTS):
+                        st = entry.stat()
+                        files.append((entry.path, d, st.st_size, st.st_mtime_ns))
+        except OSError:
+            continue
+        gone.extend(set(children.get(d, [])) - set(subdirs))
+        rescanned.append((d, mtime, files))
+        stack.extend(subdirs)
+
+    def _apply(conn):
+        for d in gone:
+            _forget(conn, d)
+        for d, mtime, files in rescanned:
+            conn.execute("DELETE FROM catalog_files WHERE dir = ?", (d,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO catalog_files (path, dir, size, mtime_ns) VALUES (?, ?, ?, ?)", files
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                (d, os.path.dirname(d), mtime)
+            )
+
+    if gone or rescanned:
+        write(_apply)
+    return True
+
+
+def catalog_totals(root):
+    """(nb videos, octets) sous root."""
+    lo, hi = _subtree(os.path.abspath(root))
+    r = get_db().execute(
+        "SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM catalog_files WHERE path >= ? AND path < ?",
+        (lo, hi)
+    ).fetchone()
+    return r['n'], r['bytes']
+
+
+def catalog_folders(root):
+    """[(nom, nb videos, octets)] des dossiers de premier niveau de root, noms decroissants."""
+    root = os.path.abspath(root)
+    conn = get_db()
+    folders = []
+    for r in conn.execute(
+        "SELECT path FROM catalog_dirs WHERE parent = ? ORDER BY path DESC", (root,)
+    ).fetchall():
+        lo, hi = _subtree(r['path'])
+        c = conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM catalog_files "
+            "WHERE path >= ? AND path < ?", (lo, hi)
+        ).fetchone()
+        folders.append((os.path.basename(r['path']), c['n'], c['bytes']))
+    return folders
+
+
+def catalog_list(folder, limit=500):
+    """Videos d'un dossier (sous-dossiers compris) : [{path, size, mtime_ns}] tries par chemin."""
+    lo, hi = _subtree(os.path.abspath(folder))
+    rows = get_db().execute(
+        "SELECT path, size, mtime_ns FROM catalog_files WHERE path >= ? AND path < ? ORDER BY path LIMIT ?",
+        (lo, hi, limit)
+    ).fetchall()
+    return [dict(r) for r in rows]
@@ -0,0 +1,90 @@
+"""
+Run Manifest — checkpoint d'une source Bulk / Ferme (manifest.json dans son dossier de sortie)
+Plans de la source + variations terminees (parametres, taille, sha256).
+Une reprise saute les Vxx.mp4 deja valides et n'encode que les manquantes.
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def manifest_path(folder):
+    return os.path.join(folder, MANIFEST_NAME)
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(folder):
+    """Manifest du dossier, ou None (absent, illisible ou d'une autre version)."""
+    try:
+        with open(manifest_path(folder), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+    manifest.setdefault("variations", {})
+    return manifest
+
+
+def save_manifest(folder, manifest):
+    """Ecriture atomique : un crash en pleine ecriture laisse l'ancien manifest intact."""
+    path = manifest_path(folder)
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def new_manifest(source, plans):
+    return {
+        "version": MANIFEST_VERSION,
+        "source": source,
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "plans": plans,
+        "variations": {},
+    }
+
+
+def record_variation(folder, manifest, name, output_path, plan, modifications, uniqueness):
+    """Ajoute une variation terminee (checksum de la sortie) et reecrit le manifest."""
+    manifest["variations"][name] = {
+        "file": os.path.basename(output_path),
+        "size": os.path.getsize(output_path),
+        "sha256": file_checksum(output_path),
+        "plan": plan,
+        "modifications": modifications,
+        "uniqueness": uniqueness,
+        "finished_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    save_manifest(folder, manifest)
+
+
+def is_valid(folder, entry):
+    """La sortie existe et correspond a la taille + au sha256 enregistres."""
+    path = os.path.join(folder, entry.get("file", ""))
+    try:
+        if os.path.getsize(path) != entry.get("size"):
+            return False
+        return file_checksum(path) == entry.get("sha256")
+    except OSError:
+        return False
+
+
+def valid_variations(folder, manifest):
+    """{nom: entree} des variations du manifest dont la sortie est intacte."""
+    if not manifest:
+        return {}
+    return {name: entry for name, entry in manifest["variations"].items() if is_valid(folder, entry)}
@@ -2,14 +2,22 @@
 Uniqueness Checker - Multi-platform duplicate detection
 """
 import os
-import json
 import hashlib
 from pathlib import Path
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from uniquifier import FFMPEG_BIN, FFPROBE_BIN
+import numpy as np
+
+from uniquifier import FFMPEG_BIN, encode_budget
+from media_probe import probe
+from hash_library import (
+    open_library, parse_video_hash, format_video_hash, phash_frames, frame_distances, similarity_percent,
+    PHASH_SIZE, MAX_FRAMES,
+)
 
 @dataclass
 class PlatformScore:
@@ -30,71 +38,71 @@ class UniquenessReport:
     duplicate_found: bool = False
     similar_videos: List[Dict] = field(default_factory=list)
 
+
+def compute_video_hash(video_path, threads=0):
+    """Compute perceptual hash using frame sampling (raw gray frames piped from ffmpeg)"""
+    try:
+        cmd = [
+            FFMPEG_BIN, "-v", "error", "-threads", str(threads), "-i", video_path,
+            "-vf", f"fps=1,scale={PHASH_SIZE}:{PHASH_SIZE}:flags=lanczos,format=gray",
+            "-frames:v", str(MAX_FRAMES),
+            "-f", "rawvideo", "-pix_fmt", "gray", "pipe:1"
+        ]
+        out = subprocess.run(cmd, capture_output=True, timeout=60).stdout
+        
+        # Whole frames only, hashed as one stack
+        size = PHASH_SIZE * PHASH_SIZE
+        n = len(out) // size
+        if not n:
+            return _file_hash(video_path)
+        frames = np.frombuffer(out, dtype=np.uint8, count=n * size).reshape(n, PHASH_SIZE, PHASH_SIZE)
+        return format_video_hash(phash_frames(frames))
+    except Exception:
+        return _file_hash(video_path)
+
+
+def _file_hash(path):
+    """Fallback: simple file hash"""
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(8192), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _video_info(video_path):
+    """Get video metadata"""
+    info = probe(video_path)
+    return info.as_ffprobe_dict() if info else {}
+
+
+def _analyze_video(video_path, threads=0):
+    """Process pool worker: the ffmpeg + ffprobe part of a check (no library access)"""
+    return video_path, compute_video_hash(video_path, threads), _video_info(video_path)
+
+
 class UniquenessChecker:
-    def __init__(self, library_path="video_library"):
+    def __init__(self, library_path="video_library", use_index=None):
         self.library_path = library_path
-        self.hashes_file = os.path.join(library_path, "hashes.json")
-        self._ensure_library()
-    
-    def _ensure_library(self):
-        os.makedirs(self.library_path, exist_ok=True)
-        if not os.path.exists(self.hashes_file):
-            with open(self.hashes_file, 'w') as f:
-                json.dump({}, f)
+        # hashes.db, loaded once per process (an old hashes.json is imported on first open)
+        self.library = open_library(library_path)
+        # Radius search through the frame index instead of a full scan, for this checker only
+        # (the library is shared). None: automatic once the library is large enough (INDEX_MIN_VIDEOS)
+        self.use_index = use_index
     
     def _compute_video_hash(self, video_path):
         """Compute perceptual hash using frame sampling"""
-        try:
-            from PIL import Image
-            import imagehash
-            import tempfile
-            
-            # Extract frames
-            with tempfile.TemporaryDirectory() as tmpdir:
-                cmd = [
-                    FFMPEG_BIN, "-i", video_path,
-                    "-vf", "fps=1,scale=64:64",
-                    "-frames:v", "8",
-                    f"{tmpdir}/frame_%02d.jpg"
-                ]
-                subprocess.run(cmd, capture_output=True, timeout=60)
-                
-                # Hash frames
-                hashes = []
-                for i in range(1, 9):
-                    frame_path = f"{tmpdir}/frame_{i:02d}.jpg"
-                    if os.path.exists(frame_path):
-                        img = Image.open(frame_path)
-                        h = imagehash.phash(img)
-                        hashes.append(str(h))
-                
-                return "_".join(hashes) if hashes else self._file_hash(video_path)
-        except Exception as e:
-            return self._file_hash(video_path)
+        return compute_video_hash(video_path)
     
     def _file_hash(self, path):
         """Fallback: simple file hash"""
-        h = hashlib.md5()
-        with open(path, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b''):
-                h.update(chunk)
-        return h.hexdigest()
+        return _file_hash(path)
     
     def _get_video_info(self, video_path):
         """Get video metadata"""
-        if not FFPROBE_BIN:
-            return {}
-        cmd = [
-            FFPROBE_BIN, "-v", "quiet", "-print_format", "json",
-            "-show_format", "-show_streams", video_path
-        ]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            return json.loads(result.stdout)
-        except Exception:
-            return {}
+        return _video_info(video_path)
     
-    def _evaluate_tiktok(self, video_path, video_hash, info):
+    def _evaluate_tiktok(self, video_path, video_hash, info, dup_score=None):
         """TikTok: strictest detection (deep learning + perceptual hash)"""
         score = 100
         issues = []
@@ -111,7 +119,8 @@ class UniquenessChecker:
             pass
         
         # Check for duplicates in library
-        dup_score = self._check_library_duplicates(video_hash)
+        if dup_score is None:
+            dup_score = self._check_library_duplicates(video_hash)
         if dup_score > 90:
             score -= 40
             issues.append("Hash très similaire détecté dans la bibliothèque")
@@ -139,7 +148,7 @@ class UniquenessChecker:
         risk = self._get_risk_level(score)
         return PlatformScore("tiktok", max(0, score), risk, issues, recommendations)
     
-    def _evaluate_instagram(self, video_path, video_hash, info):
+    def _evaluate_instagram(self, video_path, video_hash, info, dup_score=None):
         """Instagram: moderate detection (watermark + content matching)"""
         score = 100
         issues = []
@@ -156,7 +165,8 @@ class UniquenessChecker:
             pass
         
         # Check duplicates
-        dup_score = self._check_library_duplicates(video_hash)
+        if dup_score is None:
+            dup_score = self._check_library_duplicates(video_hash)
         if dup_score > 85:
             score -= 30
             issues.append("Contenu très similaire détecté")
@@ -169,7 +179,7 @@ class UniquenessChecker:
         risk = self._get_risk_level(score)
         return PlatformScore("instagram", max(0, score), risk, issues, recommendations)
     
-    def _evaluate_youtube(self, video_path, video_hash, info):
+    def _evaluate_youtube(self, video_path, video_hash, info, dup_score=None):
         """YouTube: Content ID focus (audio fingerprinting)"""
         score = 100
         issues = []
@@ -194,7 +204,8 @@ class UniquenessChecker:
             recommendations.append("Utiliser musique libre de droits ou modifier le pitch audio")
         
         # Check duplicates
-        dup_score = self._check_library_duplicates(video_hash)
+        if dup_score is None:
+            dup_score = self._check_library_duplicates(video_hash)
         if dup_score > 80:
             score -= 25
             issues.append("Vidéo similaire dans la bibliothèque")
@@ -203,32 +214,19 @@ class UniquenessChecker:
         risk = self._get_risk_level(score)
         return PlatformScore("youtube", max(0, score), risk, issues, recommendations)
     
-    def _check_library_duplicates(self, video_hash):
+    def _similar_videos(self, video_hash, k=5):
+        """Closest library videos (vectorized Hamming search, near matches included)"""
+        entry = self.library.get(video_hash)
+        if entry:
+            return [{"video_hash": video_hash, "path": entry[1], "similarity": 100.0,
+                     "distances": [0] * len(entry[2]), "mean_distance": 0.0}]
+        return self.library.search(parse_video_hash(video_hash), k=k, use_index=self.use_index)
+
+    def _check_library_duplicates(self, video_hash, similar=None):
         """Check similarity with existing videos in library"""
-        try:
-            with open(self.hashes_file, 'r') as f:
-                library = json.load(f)
-            
-            if not library:
-                return 0
-            
-            max_similarity = 0
-            hash_parts = video_hash.split('_')
-            
-            for stored_hash in library.keys():
-                stored_parts = stored_hash.split('_')
-                
-                # Compare hash parts
-                if len(hash_parts) == len(stored_parts):
-                    matches = sum(1 for a, b in zip(hash_parts, stored_parts) if a == b)
-                    similarity = (matches / len(hash_parts)) * 100
-                    max_similarity = max(max_similarity, similarity)
-                elif video_hash == stored_hash:
-                    max_similarity = 100
-            
-            return max_similarity
-        except Exception:
-            return 0
+        if similar is None:
+            similar = self._similar_videos(video_hash, k=1)
+        return similar[0]["similarity"] if similar else 0
     
     def _get_risk_level(self, score):
         if score >= 80:
@@ -244,10 +242,42 @@ class UniquenessChecker:
         video_hash = self._compute_video_hash(video_path)
         info = self._get_video_info(video_path)
         
+        # Pick up other processes' additions first
+        self.library.refresh()
+        return self._report(video_path, video_hash, info, add_to_library)
+    
+    def check_many(self, paths, workers=None, add_to_library=False):
+        """Check many videos: ffmpeg/ffprobe analysis spread over a process pool, library
+        lookups and scoring here (library loaded once). Yields UniquenessReports as they finish."""
+        paths = list(paths)
+        if not paths:
+            return
+        # Same core budget as the encodes (affinity / cgroup aware, TIKFUSION_WORKERS / _THREADS)
+        workers, threads = encode_budget(len(paths), workers, threads=1)
+        self.library.refresh()
+        # spawn: never fork the multi-threaded Streamlit server
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = [pool.submit(_analyze_video, path, threads) for path in paths]
+            for future in as_completed(futures):
+                video_path, video_hash, info = future.result()
+                yield self._report(video_path, video_hash, info, add_to_library)
+        finally:
+            # Caller stopped early: drop the analyses not started yet
+            pool.shutdown(wait=False, cancel_futures=True)
+            # Next process loads the index instead of rebuilding it
+            self.library.save_index()
+    
+    def _report(self, video_path, video_hash, info, add_to_library=False):
+        """Score every platform from one analysis (hash + ffprobe info)"""
+        # One library lookup shared by every platform
+        similar = self._similar_videos(video_hash)
+        dup_score = self._check_library_duplicates(video_hash, similar)
+        
         # Evaluate per platform
-        tiktok = self._evaluate_tiktok(video_path, video_hash, info)
-        instagram = self._evaluate_instagram(video_path, video_hash, info)
-        youtube = self._evaluate_youtube(video_path, video_hash, info)
+        tiktok = self._evaluate_tiktok(video_path, video_hash, info, dup_score)
+        instagram = self._evaluate_instagram(video_path, video_hash, info, dup_score)
+        youtube = self._evaluate_youtube(video_path, video_hash, info, dup_score)
         
         # Overall score (weighted average - TikTok strictest)
         overall = int((tiktok.uniqueness_score * 0.4 + 
@@ -255,7 +285,6 @@ class UniquenessChecker:
                       youtube.uniqueness_score * 0.3))
         
         # Check for duplicates
-        dup_score = self._check_library_duplicates(video_hash)
         duplicate_found = dup_score > 80
         
         # Add to library if requested
@@ -269,27 +298,19 @@ class UniquenessChecker:
             tiktok=tiktok,
             instagram=instagram,
             youtube=youtube,
-            duplicate_found=duplicate_found
+            duplicate_found=duplicate_found,
+            similar_videos=similar
         )
     
     def _add_to_library(self, video_path, video_hash, overall, tiktok, instagram, youtube):
-        """Add video to library"""
+        """Add video to library (one appended row, not a rewrite of the library)"""
         try:
-            with open(self.hashes_file, 'r') as f:
-                library = json.load(f)
-            
-            library[video_hash] = {
-                "path": video_path,
-                "scores": {
-                    "overall": overall,
-                    "tiktok": tiktok.uniqueness_score,
-                    "instagram": instagram.uniqueness_score,
-                    "youtube": youtube.uniqueness_score
-                }
-            }
-            
-            with open(self.hashes_file, 'w') as f:
-                json.dump(library, f, indent=2)
+            self.library.add(video_hash, video_path, scores={
+                "overall": overall,
+                "tiktok": tiktok.uniqueness_score,
+                "instagram": instagram.uniqueness_score,
+                "youtube": youtube.uniqueness_score
+            })
         except Exception:
             pass
     
@@ -298,14 +319,14 @@ class UniquenessChecker:
         hash1 = self._compute_video_hash(video1_path)
         hash2 = self._compute_video_hash(video2_path)
         
-        parts1 = hash1.split('_')
-        parts2 = hash2.split('_')
+        frames1 = parse_video_hash(hash1)
+        frames2 = parse_video_hash(hash2)
+        distances = frame_distances(frames1, frames2)
         
-        if len(parts1) == len(parts2) and len(parts1) > 1:
-            matches = sum(1 for a, b in zip(parts1, parts2) if a == b)
-            similarity = (matches / len(parts1)) * 100
-        elif hash1 == hash2:
+        if hash1 == hash2:
             similarity = 100
+        elif distances:
+            similarity = similarity_percent(distances, max(len(frames1), len(frames2)))
         else:
             similarity = 0
         
@@ -315,5 +336,6 @@ class UniquenessChecker:
             "similarity_percent": round(similarity, 1),
             "verdict": verdict,
             "hash1": hash1,
-            "hash2": hash2
+            "hash2": hash2,
+            "frame_distances": distances
         }
@@ -5,13 +5,21 @@ Parallel batch processing with ThreadPoolExecutor.
 """
 import subprocess
 import os
+import json
 import random
+import secrets
 import string
 import uuid
 import shutil
+import tempfile
+import bisect
+import threading
+from collections import deque
 from pathlib import Path
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from media_probe import probe, keyframe_times
 
 
 def _find_ffmpeg():
@@ -56,37 +64,75 @@ FFPROBE_BIN = _find_ffprobe()
 
 
 def _get_video_resolution(input_path):
-    """Get original video width and height via ffprobe"""
-    if not FFPROBE_BIN:
-        return None, None
-    try:
-        cmd = [FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
-               "-show_entries", "stream=width,height",
-               "-of", "csv=p=0:s=x", input_path]
-        r = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        if r.returncode == 0 and 'x' in r.stdout:
-            w, h = r.stdout.strip().split('x')[:2]
-            return int(w), int(h)
-    except Exception:
-        pass
+    """Get displayed video width and height (via the shared probe cache).
+    ffmpeg auto-rotates before the filter graph, so 90/270 rotations swap the coded size."""
+    info = probe(input_path)
+    if info and info.width and info.height:
+        if info.rotation in (90, 270):
+            return int(info.height), int(info.width)
+        return int(info.width), int(info.height)
     return None, None
 
 
 def _get_audio_sample_rate(input_path):
-    """Get original audio sample rate via ffprobe (default 44100)"""
-    if not FFPROBE_BIN:
-        return 44100
-    try:
-        cmd = [FFPROBE_BIN, "-v", "error", "-select_streams", "a:0",
-               "-show_entries", "stream=sample_rate",
-               "-of", "csv=p=0", input_path]
-        r = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        if r.returncode == 0 and r.stdout.strip():
-            return int(r.stdout.strip())
-    except Exception:
-        pass
+    """Get original audio sample rate (default 44100)"""
+    info = probe(input_path)
+    if info and info.sample_rate:
+        return info.sample_rate
     return 44100
 
+
+def _has_audio_stream(input_path):
+    """True si la video contient une piste audio (True par defaut si ffprobe absent)"""
+    info = probe(input_path)
+    return info.has_audio if info else True
+
+
+# Max outputs sharing one decode (each branch holds its own frame queue + x264 encoder)
+MAX_BRANCHES_PER_PROCESS = 4
+
+# libx264 ultrafast stops scaling well past ~4 threads per process
+THREADS_PER_JOB = 4
+
+
+def available_cpus():
+    """Coeurs reellement utilisables par ce process (affinite / cgroup cpuset)"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def _env_int(name):
+    try:
+        return max(0, int(os.environ.get(name, "0")))
+    except ValueError:
+        return 0
+
+
+def encode_budget(jobs, workers=None, threads=None):
+    """Choisit (nb d'encodages paralleles, threads par process ffmpeg) pour `jobs` process.
+    Priorite: arguments > env TIKFUSION_WORKERS / TIKFUSION_THREADS > auto (coeurs disponibles)."""
+    cpus = available_cpus()
+    workers = workers or _env_int("TIKFUSION_WORKERS")
+    threads = threads or _env_int("TIKFUSION_THREADS")
+
+    if not workers:
+        workers = max(1, cpus // (threads or min(THREADS_PER_JOB, cpus)))
+    workers = max(1, min(workers, jobs))
+
+    # Fewer jobs than slots → give the leftover cores to each running process
+    if not threads:
+        threads = max(1, cpus // workers)
+    return workers, threads
+
+
+def single_encode_threads(threads=None):
+    """Threads d'un encodage isole (onglet Single, VideoUniquifier) : la taille d'un slot de
+    encode_budget, pas toute la machine, pour cohabiter avec les jobs de fond.
+    Priorite: argument > env TIKFUSION_THREADS > min(THREADS_PER_JOB, coeurs disponibles)."""
+    return threads or _env_int("TIKFUSION_THREADS") or min(THREADS_PER_JOB, available_cpus())
+
 INTENSITY_PRESETS = {
     "low": {
         "speed_range": (0.98, 1.02),       # Très subtil — quasi imperceptible
@@ -127,8 +173,29 @@ DEFAULT_ENABLED = {
     "pitch": True, "fps": True, "meta": True,
 }
 
-def uniquify_video_ffmpeg(input_path, output_path, intensity="medium", enabled_mods=None):
-    """Applique des modifications anti-detection. Chaque mod peut etre desactivee."""
+# Metadata pools (randomised per variation when "meta" is enabled)
+ENCODERS = ["Lavf58.76.100", "Lavf59.27.100", "Lavf60.3.100", "HandBrake 1.6.1",
+            "Adobe Premiere Pro", "DaVinci Resolve 18", "CapCut 3.2", "FFmpeg 6.0",
+            "iMovie 10.3", "Final Cut Pro X", "Filmora 13", "VLC media player",
+            "Adobe Media Encoder 2024", "Shotcut 24.01", "OpenShot 3.1"]
+HANDLER_NAMES = ["VideoHandler", "MainHandler", "ISO Media", "Apple Video Media Handler",
+                 "Core Media Video", "GPAC ISO Video Handler", "Mainconcept Video Media Handler",
+                 "L-SMASH Video Handler", "VideoHandle"]
+
+
+def new_seed():
+    """Graine 63 bits (tient dans un INTEGER SQLite)."""
+    return secrets.randbits(63)
+
+
+def sample_variation_params(intensity="medium", enabled_mods=None, rng=None, seed=None):
+    """Tire toutes les valeurs aleatoires d'une variation, sans rien encoder.
+    Le dict retourne suffit a construire la commande ffmpeg (voir uniquify_video_ffmpeg).
+    Tirage dans un random.Random(seed) propre : meme (intensity, enabled_mods, seed) → memes valeurs
+    (seul creation_time depend de la date du tirage ; le plan resolu, lui, le fige)."""
+    if rng is None:
+        seed = new_seed() if seed is None else seed
+        rng = random.Random(seed)
     preset = INTENSITY_PRESETS.get(intensity, INTENSITY_PRESETS["medium"])
     mods = {**DEFAULT_ENABLED, **(enabled_mods or {})}
 
@@ -136,192 +203,901 @@ def uniquify_video_ffmpeg(input_path, output_path, intensity="medium", enabled_m
 
     speed = 1.0
     if mods["speed"]:
-        speed = random.uniform(*preset["speed_range"])
+        speed = rng.uniform(*preset["speed_range"])
 
     hue_shift = 0
     saturation = 1.0
     if mods["hue"]:
-        hue_shift = random.randint(-preset["color_shift"], preset["color_shift"])
+        hue_shift = rng.randint(-preset["color_shift"], preset["color_shift"])
         if abs(hue_shift) < 2:
-            hue_shift = random.choice([-1, 1]) * random.randint(2, preset["color_shift"])
-        saturation = random.uniform(0.97, 1.03)  # Réduit (était 0.94-1.06) — moins visible
+            hue_shift = rng.choice([-1, 1]) * rng.randint(2, preset["color_shift"])
+        saturation = rng.uniform(0.97, 1.03)  # Réduit (était 0.94-1.06) — moins visible
 
-    brightness = random.uniform(-0.03, 0.03)  # always subtle, part of encoding
+    brightness = rng.uniform(-0.03, 0.03)  # always subtle, part of encoding
 
     crop_pct = 0.0
     if mods["crop"]:
-        crop_pct = random.uniform(0.5, preset["crop_percent"]) / 100
+        crop_pct = rng.uniform(0.5, preset["crop_percent"]) / 100
 
     zoom = 1.0
     if mods["zoom"]:
-        zoom = random.uniform(*preset["zoom_range"])
+        zoom = rng.uniform(*preset["zoom_range"])
 
     noise_strength = 0
     if mods["noise"]:
-        noise_strength = random.uniform(1, preset["noise_strength"])
+        noise_strength = rng.uniform(1, preset["noise_strength"])
 
     do_hflip = False
     if mods["hflip"]:
-        do_hflip = random.random() < preset["hflip_chance"]
+        do_hflip = rng.random() < preset["hflip_chance"]
 
     target_fps = 30.0
     if mods["fps"]:
-        fps_shift = random.uniform(-preset["fps_shift"], preset["fps_shift"])
+        fps_shift = rng.uniform(-preset["fps_shift"], preset["fps_shift"])
         target_fps = round(30 + fps_shift, 2)
 
     gamma = 1.0
     if mods["gamma"]:
-        gamma = random.uniform(0.97, 1.03)
+        gamma = rng.uniform(0.97, 1.03)
 
     pitch_semitones = 0.0
     if mods["pitch"]:
-        pitch_semitones = random.uniform(-preset["pitch_semitones"], preset["pitch_semitones"])
+        pitch_semitones = rng.uniform(-preset["pitch_semitones"], preset["pitch_semitones"])
         if abs(pitch_semitones) < 0.1:
-            pitch_semitones = random.choice([-1, 1]) * random.uniform(0.1, preset["pitch_semitones"])
+            pitch_semitones = rng.choice([-1, 1]) * rng.uniform(0.1, preset["pitch_semitones"])
+
+    audio_volume = rng.uniform(0.97, 1.03)
+
+    # === ENCODING ===
+    crf = rng.randint(17, 20)
+    gop_size = rng.choice([24, 30, 48, 60, 72])
+    bf_count = rng.choice([0, 1, 2, 3])
+
+    # === METADATA ===
+    metadata = None
+    if mods["meta"]:
+        metadata = {
+            "title": ''.join(rng.choices(string.ascii_letters + string.digits + ' _-', k=rng.randint(8, 32))),
+            "comment": ''.join(rng.choices(string.ascii_letters + string.digits + ' .,!', k=rng.randint(10, 48))),
+            "encoder": rng.choice(ENCODERS),
+            "handler_name": rng.choice(HANDLER_NAMES),
+            "creation_time": (datetime.now() - timedelta(days=rng.uniform(0, 30))).isoformat() + "Z",
+            "file_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "major_brand": "mp42",
+            "minor_version": rng.randint(0, 512),
+        }
+
+    return {
+        "seed": seed,
+        "intensity": intensity,
+        "mods": mods,
+        "speed": speed,
+        "hue_shift": hue_shift,
+        "saturation": saturation,
+        "brightness": brightness,
+        "crop_pct": crop_pct,
+        "zoom": zoom,
+        "noise_strength": noise_strength,
+        "hflip": do_hflip,
+        "fps": target_fps,
+        "gamma": gamma,
+        "pitch_semitones": pitch_semitones,
+        "audio_volume": audio_volume,
+        "crf": crf,
+        "gop": gop_size,
+        "bf": bf_count,
+        "metadata": metadata,
+    }
+
+
+def params_to_modifications(params):
+    """Resume lisible (et stocke en base) d'un jeu de parametres."""
+    mods = params["mods"]
+    return {
+        "speed": round(params["speed"], 3),
+        "hue_shift": params["hue_shift"] if mods["hue"] else 0,
+        "saturation": round(params["saturation"], 2),
+        "brightness": round(params["brightness"], 3),
+        "crop_percent": round(params["crop_pct"] * 100, 1),
+        "zoom": round(params["zoom"], 3),
+        "noise": round(params["noise_strength"], 1),
+        "hflip": params["hflip"],
+        "pitch_semitones": round(params["pitch_semitones"], 2),
+        "fps": params["fps"],
+        "gamma": round(params["gamma"], 3),
+        "crf": params["crf"],
+        "gop": params["gop"],
+        "metadata_randomized": mods["meta"],
+    }
+
+
+# Exportable plans: a fully resolved params dict, or just {intensity, mods, seed}
+PLAN_FORMAT = 1
+PLAN_KEYS = ("mods", "speed", "hue_shift", "saturation", "brightness", "crop_pct", "zoom",
+             "noise_strength", "hflip", "fps", "gamma", "pitch_semitones", "audio_volume",
+             "crf", "gop", "bf", "metadata")
+
+
+def plan_to_json(params):
+    """Plan resolu → JSON, rejouable tel quel (plan_from_json + uniquify_video_ffmpeg)."""
+    return json.dumps({"format": PLAN_FORMAT, **params}, sort_keys=True)
+
+
+def plan_from_json(data):
+    """JSON (str ou dict) → params. Un plan sans valeurs resolues est re-tire depuis sa graine."""
+    plan = json.loads(data) if isinstance(data, (str, bytes)) else dict(data)
+    if plan.pop("format", PLAN_FORMAT) > PLAN_FORMAT:
+        raise ValueError("Plan produit par une version plus recente")
+    missing = [k for k in PLAN_KEYS if k not in plan]
+    if missing:
+        if plan.get("seed") is None:
+            raise ValueError(f"Plan incomplet et sans seed: {', '.join(missing)}")
+        return sample_variation_params(plan.get("intensity", "medium"), plan.get("mods"), seed=plan["seed"])
+    plan["mods"] = {**DEFAULT_ENABLED, **plan["mods"]}
+    plan.setdefault("seed", None)
+    plan.setdefault("intensity", "medium")
+    return plan
+
+
+def plans_to_json(plans):
+    return json.dumps({"format": PLAN_FORMAT, "plans": list(plans)}, indent=2, sort_keys=True)
+
+
+def plans_from_json(data):
+    """Accepte l'export de plans_to_json, une liste de plans ou un plan seul."""
+    doc = json.loads(data) if isinstance(data, (str, bytes)) else data
+    if isinstance(doc, dict) and "plans" in doc:
+        doc = doc["plans"]
+    if isinstance(doc, dict):
+        doc = [doc]
+    return [plan_from_json(p) for p in doc]
+
+
+def modifications_distance(mods_a, mods_b):
+    """Compare 2 sets of modifications, return distance score 0-100 (100=totally different).
+    Normalized by real parameter ranges, weighted by detection importance."""
+    # Realistic max difference per param (calibrated on medium intensity)
+    # Using medium ranges ensures threshold=30 is achievable at all intensities
+    ranges = {
+        "noise": 6.0,
+        "zoom": 0.05,
+        "gamma": 0.06,
+        "hue_shift": 12.0,
+        "crop_percent": 1.5,
+        "speed": 0.06,
+        "pitch_semitones": 1.2,
+        "fps": 0.12,
+    }
+    # Weights by detection importance (sum = 100)
+    weights = {
+        "pitch_semitones": 22,
+        "noise": 20,
+        "hflip": 15,
+        "zoom": 15,
+        "gamma": 6,
+        "fps": 6,
+        "speed": 6,
+        "crop_percent": 5,
+        "hue_shift": 5,
+    }
+    # Parameters that are offset from a base value
+    bases = {"zoom": 1.0, "gamma": 1.0, "speed": 1.0, "fps": 30.0}
+
+    score = 0.0
+    for param, max_range in ranges.items():
+        base = bases.get(param, 0.0)
+        val_a = mods_a.get(param, base) - base
+        val_b = mods_b.get(param, base) - base
+        normalized = min(abs(val_a - val_b) / max(max_range, 1e-9), 1.0)
+        score += normalized * weights.get(param, 0)
+
+    # Binary hflip
+    if mods_a.get("hflip", False) != mods_b.get("hflip", False):
+        score += weights["hflip"]
+
+    return round(min(score, 100))
+
+
+def estimate_uniqueness(modifications):
+    score = 0
+    score += min(modifications.get("noise", 0) * 3, 18)
+    score += min((modifications.get("zoom", 1.0) - 1.0) * 350, 14)
+    score += min(abs(modifications.get("gamma", 1.0) - 1.0) * 200, 5)
+    score += min(abs(modifications.get("hue_shift", 0)) * 0.15, 2)
+    if modifications.get("hflip", False): score += 12
+    score += min(modifications.get("crop_percent", 0) * 2, 4)
+    score += min(abs(modifications.get("speed", 1.0) - 1.0) * 40, 3)
+    score += min(abs(modifications.get("pitch_semitones", 0)) * 35, 20)
+    score += min(abs(modifications.get("fps", 30) - 30) * 50, 5)
+    score += 3  # volume
+    if modifications.get("metadata_randomized", False): score += 5
+    score += 8  # re-encoding
+    return {'uniqueness': min(round(score), 100)}
+
+
+class VariationPlanner:
+    """Planifie N jeux de parametres diversifies AVANT d'encoder.
+    Tirage + controle de distance en pur Python : chaque variation n'est encodee qu'une fois."""
+
+    def __init__(self, intensity="medium", enabled_mods=None, min_distance=30,
+                 max_attempts=60, max_iterations=10, rng=None, seed=None):
+        self.intensity = intensity
+        self.enabled_mods = enabled_mods
+        self.min_distance = min_distance
+        self.max_attempts = max_attempts
+        self.max_iterations = max_iterations
+        # Same seed → same plans; each plan also carries its own seed
+        self.seed = new_seed() if seed is None and rng is None else seed
+        self.rng = rng or random.Random(self.seed)
+
+    def sample(self):
+        return sample_variation_params(self.intensity, self.enabled_mods, seed=self.rng.getrandbits(63))
+
+    def _fails(self, mods, others):
+        """(nb de conflits, distance min) de mods face a une liste de modifications."""
+        if not others:
+            return 0, 100
+        dists = [modifications_distance(mods, o) for o in others]
+        return sum(1 for d in dists if d < self.min_distance), min(dists)
+
+    def pick(self, others):
+        """Meilleur candidat face a `others` : 0 conflit, sinon moins de conflits puis plus grande distance min."""
+        best, best_key = None, None
+        for _ in range(self.max_attempts):
+            params = self.sample()
+            fails, min_dist = self._fails(params_to_modifications(params), others)
+            if fails == 0:
+                return params
+            key = (-fails, min_dist)
+            if best_key is None or key > best_key:
+                best, best_key = params, key
+        return best
+
+    def plan(self, count, previous_mods=None):
+        """Retourne `count` jeux de parametres, diversifies entre eux et face a previous_mods."""
+        fixed = list(previous_mods or [])
+        plans = []
+        for _ in range(count):
+            plans.append(self.pick(fixed + [params_to_modifications(p) for p in plans]))
+        self._refine(plans, fixed)
+        return plans
+
+    def _refine(self, plans, fixed):
+        """Post-check par paires : re-tire le plan le plus en conflit (en memoire, sans encoder)."""
+        already_tried = set()  # indices already re-drawn — avoid infinite loops
+        for _iteration in range(self.max_iterations):
+            all_mods = [params_to_modifications(p) for p in plans]
+            fail_count = {}
+            for i in range(len(plans)):
+                for j in range(i + 1, len(plans)):
+                    if modifications_distance(all_mods[i], all_mods[j]) < self.min_distance:
+                        fail_count[i] = fail_count.get(i, 0) + 1
+                        fail_count[j] = fail_count.get(j, 0) + 1
+            if not fail_count:
+                return
+
+            candidates = [(cnt, idx) for idx, cnt in fail_count.items() if idx not in already_tried]
+            if not candidates:
+                return
+            candidates.sort(reverse=True)
+            worst_idx = candidates[0][1]
+            already_tried.add(worst_idx)
+
+            others = fixed + [m for i, m in enumerate(all_mods) if i != worst_idx]
+            old_fails, _ = self._fails(all_mods[worst_idx], others)
+            new = self.pick(others)
+            new_fails, _ = self._fails(params_to_modifications(new), others)
+            if new_fails <= old_fails:
+                # Accept same or better (lateral moves help escape local minima)
+                plans[worst_idx] = new
+                if new_fails < old_fails:
+                    already_tried.discard(worst_idx)
+
+
+# Single resample per frame, so a better kernel than the old 2x fast_bilinear is affordable
+SCALE_FLAGS = "bilinear"
+
+
+def compile_geometry(params, orig_w, orig_h):
+    """Compile crop % + zoom + resolution cible en UN rectangle de crop et UN scale.
+    crop(1-c) puis zoom z (scale x z + crop centre /z) == crop centre de (1-c)/z, puis scale vers la cible.
+    Retourne {"crop": str|None, "scale": [str], "pixel_first": bool} ; pixel_first = filtres
+    par pixel (hue/eq/noise) avant le scale, si la zone croppee est plus petite que la sortie."""
+    mods = params["mods"]
+    keep = 1.0
+    if mods["crop"] and params["crop_pct"] > 0:
+        keep *= 1 - params["crop_pct"]
+    if mods["zoom"] and params["zoom"] > 1.0:
+        keep /= params["zoom"]
+
+    if not (orig_w and orig_h):
+        # Unknown source size: relative crop, then fit into the standard vertical format
+        return {
+            "crop": f"crop=iw*{keep:.6f}:ih*{keep:.6f}" if keep < 1.0 else None,
+            "scale": [f"scale=1080:1920:force_original_aspect_ratio=decrease:flags={SCALE_FLAGS}",
+                      "pad=1080:1920:(ow-iw)/2:(oh-ih)/2"],
+            "pixel_first": True,
+        }
+
+    # Output keeps the source size, with even dimensions (required by h264)
+    out_w = orig_w - (orig_w % 2)
+    out_h = orig_h - (orig_h % 2)
+
+    crop_w, crop_h = orig_w, orig_h
+    crop = None
+    if keep < 1.0:
+        crop_w = max(2, int(orig_w * keep) // 2 * 2)
+        crop_h = max(2, int(orig_h * keep) // 2 * 2)
+        crop = f"crop={crop_w}:{crop_h}:{(orig_w - crop_w) // 2}:{(orig_h - crop_h) // 2}"
+
+    scale = []
+    if (crop_w, crop_h) != (out_w, out_h):
+        scale.append(f"scale={out_w}:{out_h}:flags={SCALE_FLAGS}")
+
+    return {"crop": crop, "scale": scale, "pixel_first": crop_w * crop_h <= out_w * out_h}
+
+
+def _build_video_filter(params, orig_w, orig_h):
+    """Chaine de filtres video d'une variation (sans labels)."""
+    mods = params["mods"]
+    speed = params["speed"]
+    noise_strength = params["noise_strength"]
+    target_fps = params["fps"]
+    gamma = params["gamma"]
+    brightness = params["brightness"]
+    geometry = compile_geometry(params, orig_w, orig_h)
 
-    # === BUILD VIDEO FILTER CHAIN ===
     filters = []
 
     # Speed
     if mods["speed"] and speed != 1.0:
         filters.append(f"setpts={1/speed}*PTS")
 
-    # Crop (early = process fewer pixels later)
-    if mods["crop"] and crop_pct > 0:
-        filters.append(f"crop=iw*{1-crop_pct}:ih*{1-crop_pct}")
+    # Crop + zoom as one centred crop (first = fewer pixels for everything after)
+    if geometry["crop"]:
+        filters.append(geometry["crop"])
+
+    pixel_filters = []
 
-    # Hue + Saturation (before scale = process original resolution)
+    # Hue + Saturation
     if mods["hue"]:
-        filters.append(f"hue=h={hue_shift}:s={saturation}")
+        pixel_filters.append(f"hue=h={params['hue_shift']}:s={params['saturation']}")
 
     # Brightness + Gamma combined in one eq filter
     if mods["gamma"] and gamma != 1.0:
-        filters.append(f"eq=brightness={brightness}:gamma={gamma:.3f}")
+        pixel_filters.append(f"eq=brightness={brightness}:gamma={gamma:.3f}")
     else:
-        filters.append(f"eq=brightness={brightness}")
+        pixel_filters.append(f"eq=brightness={brightness}")
 
-    # Flip
-    if do_hflip:
-        filters.append("hflip")
+    # Flip (commutes with the centred crop)
+    if params["hflip"]:
+        pixel_filters.append("hflip")
 
-    # Noise (before scale = fewer pixels to process)
+    # Noise
     if mods["noise"] and noise_strength > 0:
-        filters.append(f"noise=alls={int(noise_strength)}:allf=t")
-
-    # Zoom
-    if mods["zoom"] and zoom > 1.0:
-        filters.append(f"scale=iw*{zoom}:ih*{zoom}:flags=fast_bilinear")
-        filters.append("crop=iw/{0}:ih/{0}".format(zoom))
+        pixel_filters.append(f"noise=alls={int(noise_strength)}:allf=t")
 
-    # Restore original resolution after crop/zoom (preserves input quality)
-    orig_w, orig_h = _get_video_resolution(input_path)
-    if orig_w and orig_h:
-        # Ensure even dimensions (required by h264)
-        w = orig_w - (orig_w % 2)
-        h = orig_h - (orig_h % 2)
-        filters.append(f"scale={w}:{h}:flags=fast_bilinear")
+    # Per-pixel filters run at whichever of crop / output resolution is smaller
+    if geometry["pixel_first"]:
+        filters.extend(pixel_filters + geometry["scale"])
     else:
-        # Fallback: standard vertical format
-        filters.append("scale=1080:1920:force_original_aspect_ratio=decrease:flags=fast_bilinear")
-        filters.append("pad=1080:1920:(ow-iw)/2:(oh-ih)/2")
+        filters.extend(geometry["scale"] + pixel_filters)
 
     # FPS
     if mods["fps"] and target_fps != 30.0:
         filters.append(f"fps={target_fps}")
 
-    video_filter = ",".join(filters)
+    return ",".join(filters)
+
+
+def _build_audio_filter(params, sample_rate):
+    """Chaine de filtres audio d'une variation (sans labels)."""
+    mods = params["mods"]
+    speed = params["speed"]
+    pitch_semitones = params["pitch_semitones"]
 
-    # === AUDIO FILTERS ===
     audio_filters = []
 
     if mods["speed"] and 0.5 <= speed <= 2.0 and speed != 1.0:
         audio_filters.append(f"atempo={speed}")
 
     if mods["pitch"] and pitch_semitones != 0:
-        sample_rate = _get_audio_sample_rate(input_path)
         pitch_factor = 2 ** (pitch_semitones / 12)
         audio_filters.append(f"asetrate={sample_rate}*{pitch_factor:.6f}")
         audio_filters.append(f"aresample={sample_rate}")
 
-    audio_volume = random.uniform(0.97, 1.03)
-    audio_filters.append(f"volume={audio_volume:.3f}")
+    audio_filters.append(f"volume={params['audio_volume']:.3f}")
 
-    audio_filter = ",".join(audio_filters)
+    return ",".join(audio_filters)
 
-    # === ENCODING ===
-    crf = random.randint(17, 20)
-    gop_size = random.choice([24, 30, 48, 60, 72])
-    bf_count = random.choice([0, 1, 2, 3])
 
-    # === METADATA ===
-    encoders = ["Lavf58.76.100", "Lavf59.27.100", "Lavf60.3.100", "HandBrake 1.6.1",
-                "Adobe Premiere Pro", "DaVinci Resolve 18", "CapCut 3.2", "FFmpeg 6.0",
-                "iMovie 10.3", "Final Cut Pro X", "Filmora 13", "VLC media player",
-                "Adobe Media Encoder 2024", "Shotcut 24.01", "OpenShot 3.1"]
-    handler_names = ["VideoHandler", "MainHandler", "ISO Media", "Apple Video Media Handler",
-                     "Core Media Video", "GPAC ISO Video Handler", "Mainconcept Video Media Handler",
-                     "L-SMASH Video Handler", "VideoHandle"]
+def _video_codec_args(params):
+    return ["-c:v", "libx264", "-crf", str(params["crf"]), "-preset", "ultrafast",
+            "-g", str(params["gop"]), "-bf", str(params["bf"])]
 
-    # === TRACK MODIFICATIONS ===
-    modifications = {
-        "speed": round(speed, 3),
-        "hue_shift": hue_shift if mods["hue"] else 0,
-        "saturation": round(saturation, 2),
-        "brightness": round(brightness, 3),
-        "crop_percent": round(crop_pct * 100, 1),
-        "zoom": round(zoom, 3),
-        "noise": round(noise_strength, 1),
-        "hflip": do_hflip,
-        "pitch_semitones": round(pitch_semitones, 2),
-        "fps": target_fps,
-        "gamma": round(gamma, 3),
-        "crf": crf,
-        "gop": gop_size,
-        "metadata_randomized": mods["meta"],
-    }
 
-    # === BUILD COMMAND ===
-    cmd = [FFMPEG_BIN, "-y", "-threads", "0", "-i", input_path]
-    cmd.extend(["-vf", video_filter])
-    cmd.extend(["-filter_threads", "0"])
-    if audio_filter:
-        cmd.extend(["-af", audio_filter])
+def _metadata_args(params):
+    args = []
+    if params["metadata"]:
+        for key, value in params["metadata"].items():
+            args.extend(["-metadata", f"{key}={value}"])
+    return args
+
 
-    cmd.extend([
-        "-c:v", "libx264", "-crf", str(crf), "-preset", "ultrafast",
-        "-g", str(gop_size), "-bf", str(bf_count),
+def _build_output_args(params, threads=0):
+    """Options d'encodage + metadata propres a une sortie (threads=0 → auto ffmpeg)."""
+    args = _video_codec_args(params) + [
         "-c:a", "aac", "-b:a", "128k",
         "-movflags", "+faststart",
         "-sn", "-dn",
-        "-threads", "0",
-    ])
+        "-threads", str(threads),
+    ]
 
     # Metadata (only if enabled)
-    if mods["meta"]:
-        random_title = ''.join(random.choices(string.ascii_letters + string.digits + ' _-', k=random.randint(8, 32)))
-        random_comment = ''.join(random.choices(string.ascii_letters + string.digits + ' .,!', k=random.randint(10, 48)))
-        random_creation = (datetime.now() - timedelta(days=random.uniform(0, 30))).isoformat() + "Z"
-        cmd.extend([
-            "-metadata", f"title={random_title}",
-            "-metadata", f"comment={random_comment}",
-            "-metadata", f"encoder={random.choice(encoders)}",
-            "-metadata", f"handler_name={random.choice(handler_names)}",
-            "-metadata", f"creation_time={random_creation}",
-            "-metadata", f"file_id={str(uuid.uuid4())}",
-            "-metadata", f"major_brand=mp42",
-            "-metadata", f"minor_version={random.randint(0, 512)}",
-        ])
+    args.extend(_metadata_args(params))
+    return args
+
+
+# ffmpeg runner: -progress on stdout (key=value blocks), stderr kept as a bounded tail
+STDERR_TAIL_LINES = 40
+
+
+def _progress_stats(block):
+    """Bloc -progress → {frame, fps, out_time (s, temps de sortie), speed, end}."""
+    def _num(key, cast=float):
+        try:
+            return cast(block[key].rstrip("x"))
+        except (KeyError, ValueError):
+            return None
+    # out_time_ms is in microseconds too (historical ffmpeg naming)
+    out_us = _num("out_time_us", int)
+    if out_us is None:
+        out_us = _num("out_time_ms", int)
+    return {
+        "frame": _num("frame", int),
+        "fps": _num("fps"),
+        "out_time": max(0.0, out_us / 1_000_000) if out_us is not None else None,
+        "speed": _num("speed"),
+        "end": block.get("progress") == "end",
+    }
+
+
+def _progress_fraction(stats, duration, speed=1.0):
+    """Part de la source traitee. out_time est en temps de sortie, donc apres setpts."""
+    if not duration or stats["out_time"] is None:
+        return None
+    return min(1.0, stats["out_time"] * speed / duration)
+
+
+def _run_ffmpeg(cmd, timeout=300, on_progress=None):
+    """Lance ffmpeg avec -progress pipe:1 et -loglevel error. Retourne (ok, stderr).
+    on_progress(stats) est appele a chaque bloc de progression (voir _progress_stats),
+    dans le thread appelant. Seules les STDERR_TAIL_LINES dernieres lignes de stderr sont gardees."""
+    cmd = [cmd[0], "-nostdin", "-nostats", "-loglevel", "error", "-progress", "pipe:1"] + list(cmd[1:])
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True, errors="replace")
+    except OSError as e:
+        return False, str(e)
+
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    drain = threading.Thread(target=tail.extend, args=(proc.stderr,), daemon=True)
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, _kill)
+    timer.daemon = True
+    drain.start()
+    timer.start()
+    try:
+        block = {}
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            block[key] = value
+            if key != "progress":
+                continue
+            if on_progress:
+                try:
+                    on_progress(_progress_stats(block))
+                except Exception:
+                    pass  # progress is best effort — keep reading or ffmpeg blocks on the pipe
+            block = {}
+        proc.wait()
+    finally:
+        timer.cancel()
+        drain.join(timeout=5)
+
+    stderr = "".join(tail)
+    if timed_out.is_set():
+        return False, f"Timeout ffmpeg ({timeout}s)\n{stderr}"
+    return proc.returncode == 0, stderr
+
+
+def _wait_polling(futures, poll, interval=0.5):
+    """Rend les futures au fur et a mesure, en appelant poll() dans le thread appelant
+    toutes les `interval` secondes (remonte la progression des threads d'encodage)."""
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+        poll()
+        yield from done
+
+
+# Side outputs of the encode itself (thumbnails=True): no second decode of the written MP4
+THUMB_WIDTH = 160
+PREVIEW_WIDTH = 320
+PREVIEW_FRAMES = 3
+
+
+def thumbnail_path(output_path):
+    return output_path + ".thumb.jpg"
+
+
+def preview_paths(output_path):
+    return [f"{output_path}.preview_{k:02d}.jpg" for k in range(1, PREVIEW_FRAMES + 1)]
+
+
+def _side_outputs(label, output_path, out_duration, passthrough=True):
+    """Branche le thumbnail (filtre thumbnail, en basse def) et PREVIEW_FRAMES previews
+    sur la sortie video `label`. Retourne (fragments du graphe, label a encoder, args de sortie) ;
+    passthrough=False : pas de branche a encoder (label None)."""
+    # Previews spread over the output timeline (1 per second if the duration is unknown)
+    rate = f"{PREVIEW_FRAMES}/{out_duration:.3f}" if out_duration else "1"
+    branches = ([f"[{label}e]"] if passthrough else []) + [f"[{label}t]", f"[{label}p]"]
+    graph = [
+        f"[{label}]split={len(branches)}" + "".join(branches),
+        f"[{label}t]scale={THUMB_WIDTH}:-2,thumbnail=50[{label}th]",
+        f"[{label}p]fps={rate},scale={PREVIEW_WIDTH}:-2[{label}pv]",
+    ]
+    args = ["-map", f"[{label}th]", "-frames:v", "1", "-q:v", "5", "-update", "1",
+            thumbnail_path(output_path),
+            "-map", f"[{label}pv]", "-frames:v", str(PREVIEW_FRAMES), "-q:v", "6",
+            f"{output_path}.preview_%02d.jpg"]
+    return graph, (f"{label}e" if passthrough else None), args
+
+
+def _write_side_outputs(output_path, out_duration):
+    """Repli : thumbnail + previews relus depuis le MP4 termine, dans un process a part.
+    Retourne None, ou l'erreur (jamais fatale pour la variation)."""
+    graph, _, args = _side_outputs("src", output_path, out_duration, passthrough=False)
+    cmd = [FFMPEG_BIN, "-y", "-i", output_path,
+           "-filter_complex", ";".join(["[0:v]null[src]"] + graph)] + args
+    ok, err = _run_ffmpeg(cmd, timeout=60)
+    if not ok:
+        return err or "side outputs failed"
+    if not os.path.exists(thumbnail_path(output_path)):
+        return "thumbnail missing"
+    return None
+
+
+def side_output_files(output_path):
+    """{"thumbnail", "previews"} deja ecrits a cote d'une sortie."""
+    thumb = thumbnail_path(output_path)
+    return {"thumbnail": thumb if os.path.exists(thumb) else None,
+            "previews": [p for p in preview_paths(output_path) if os.path.exists(p)]}
+
+
+def uniquify_video_ffmpeg(input_path, output_path, intensity="medium", enabled_mods=None, params=None,
+                          threads=None, segmented=False, on_progress=None, seed=None, thumbnails=False):
+    """Applique des modifications anti-detection. Chaque mod peut etre desactivee.
+    `params` (voir sample_variation_params / VariationPlanner / plan_from_json) evite un nouveau tirage,
+    `seed` rend le tirage reproductible. Le resultat contient le plan resolu ("plan").
+    `threads` borne decode/filtres/encodeur (None : single_encode_threads).
+    `segmented` (opt-in) : les sources longues sont encodees par segments en parallele.
+    `thumbnails` : le meme process ecrit aussi <sortie>.thumb.jpg et les previews (hors segmente).
+    on_progress(fraction) suit l'encodage en direct (0..1)."""
+    if params is None:
+        params = sample_variation_params(intensity, enabled_mods, seed=seed)
+    if segmented and _is_long_source(input_path):
+        result = uniquify_video_segmented(input_path, output_path, params, on_progress=on_progress)
+        result["plan"] = params
+        return result
+    threads = single_encode_threads(threads)
+
+    orig_w, orig_h = _get_video_resolution(input_path)
+    info = probe(input_path)
+    duration = info.duration if info else None
+    if thumbnails:
+        # Side outputs need a labelled graph: same path as a one-output batch group
+        result = _uniquify_group(input_path, [output_path], [params], orig_w, orig_h,
+                                 _get_audio_sample_rate(input_path), _has_audio_stream(input_path),
+                                 threads, duration, on_progress, thumbnails=True)[0]
+        result["plan"] = params
+        return result
+
+    video_filter = _build_video_filter(params, orig_w, orig_h)
+
+    sample_rate = 44100
+    if params["mods"]["pitch"] and params["pitch_semitones"] != 0:
+        sample_rate = _get_audio_sample_rate(input_path)
+    audio_filter = _build_audio_filter(params, sample_rate)
+
+    # === TRACK MODIFICATIONS ===
+    modifications = params_to_modifications(params)
 
+    # === BUILD COMMAND ===
+    cmd = [FFMPEG_BIN, "-y", "-threads", str(threads), "-i", input_path]
+    cmd.extend(["-vf", video_filter])
+    cmd.extend(["-filter_threads", str(threads)])
+    if audio_filter:
+        cmd.extend(["-af", audio_filter])
+    cmd.extend(_build_output_args(params, threads))
     cmd.append(output_path)
 
+    def _on_stats(stats):
+        fraction = _progress_fraction(stats, duration, params["speed"])
+        if fraction is not None:
+            on_progress(fraction)
+
+    ok, err = _run_ffmpeg(cmd, on_progress=_on_stats if on_progress else None)
+    if ok:
+        return {"success": True, "output_path": output_path, "modifications": modifications, "plan": params}
+    return {"success": False, "error": err, "modifications": modifications, "plan": params}
+
+
+def _uniquify_group(input_path, output_paths, params_list, orig_w, orig_h, sample_rate, has_audio,
+                    threads=0, duration=None, on_progress=None, thumbnails=False):
+    """Un seul process ffmpeg : decode une fois, split en N branches, N sorties
+    (+ thumbnail et previews de chaque sortie si `thumbnails` ; s'ils font echouer le process,
+    le groupe est re-encode sans eux et ils sont extraits des MP4 finis, sans toucher a "success").
+    Les branches avancent ensemble : on_progress(fraction) vaut pour tout le groupe."""
+    n = len(output_paths)
+    graph = []
+    if n == 1:
+        graph.append(f"[0:v]{_build_video_filter(params_list[0], orig_w, orig_h)}[vout0]")
+    else:
+        graph.append(f"[0:v]split={n}" + "".join(f"[vin{i}]" for i in range(n)))
+        for i, params in enumerate(params_list):
+            graph.append(f"[vin{i}]{_build_video_filter(params, orig_w, orig_h)}[vout{i}]")
+    if has_audio:
+        if n == 1:
+            graph.append(f"[0:a]{_build_audio_filter(params_list[0], sample_rate)}[aout0]")
+        else:
+            graph.append(f"[0:a]asplit={n}" + "".join(f"[ain{i}]" for i in range(n)))
+            for i, params in enumerate(params_list):
+                graph.append(f"[ain{i}]{_build_audio_filter(params, sample_rate)}[aout{i}]")
+
+    video_labels = [f"vout{i}" for i in range(n)]
+    side_args = []
+    if thumbnails:
+        for i, (output_path, params) in enumerate(zip(output_paths, params_list)):
+            out_duration = duration / params["speed"] if duration else None
+            fragments, video_labels[i], args = _side_outputs(video_labels[i], output_path, out_duration)
+            graph.extend(fragments)
+            side_args.extend(args)
+
+    # The process budget is shared by the N encoders of this group
+    encoder_threads = max(1, threads // n) if threads else 0
+    cmd = [FFMPEG_BIN, "-y", "-threads", str(threads), "-i", input_path,
+           "-filter_complex", ";".join(graph),
+           "-filter_complex_threads", str(threads)]
+    for i, (output_path, params) in enumerate(zip(output_paths, params_list)):
+        cmd.extend(["-map", f"[{video_labels[i]}]"])
+        if has_audio:
+            cmd.extend(["-map", f"[aout{i}]"])
+        cmd.extend(_build_output_args(params, encoder_threads))
+        cmd.append(output_path)
+    cmd.extend(side_args)
+
+    modifications = [params_to_modifications(p) for p in params_list]
+    # out_time follows the furthest output, i.e. the slowest speed (longest timeline)
+    slowest = min(p["speed"] for p in params_list)
+
+    def _on_stats(stats):
+        fraction = _progress_fraction(stats, duration, slowest)
+        if fraction is not None:
+            on_progress(fraction)
+
+    # Timeout scales with the number of outputs sharing this process
+    ok, err = _run_ffmpeg(cmd, timeout=300 * n, on_progress=_on_stats if on_progress else None)
+    if not ok and thumbnails:
+        # A cosmetic output must not fail the group: encode without them, then read them
+        # back from each finished MP4 (a failure there is only recorded as "side_error")
+        results = _uniquify_group(input_path, output_paths, params_list, orig_w, orig_h, sample_rate,
+                                  has_audio, threads, duration, on_progress, thumbnails=False)
+        for r, output_path, params in zip(results, output_paths, params_list):
+            if r["success"]:
+                side_error = _write_side_outputs(output_path, duration / params["speed"] if duration else None)
+                r.update(side_output_files(output_path))
+                if side_error:
+                    r["side_error"] = side_error[:300]
+        return results
+    if ok:
+        results = [{"success": True, "output_path": o, "modifications": m,
+                    **(side_output_files(o) if thumbnails else {})}
+                   for o, m in zip(output_paths, modifications)]
+        for r in results:
+            if thumbnails and not r["thumbnail"]:
+                r["side_error"] = "thumbnail missing"
+        return results
+    return [{"success": False, "error": err, "modifications": m} for m in modifications]
+
+
+# Segment-parallel encoding (opt-in) for long sources
+SEGMENT_MIN_DURATION = 60     # seconds — shorter sources gain nothing from splitting
+SEGMENT_SECONDS = 20          # target chunk length, snapped to the nearest keyframe
+
+
+def _is_long_source(input_path):
+    info = probe(input_path)
+    return bool(info and info.duration and info.duration >= SEGMENT_MIN_DURATION)
+
+
+def _segment_bounds(duration, keyframes, segment_seconds=SEGMENT_SECONDS):
+    """[(start, length|None)] — every ~segment_seconds boundary snapped to the nearest real
+    keyframe, so each input seek lands on one; the last chunk runs to the end (length None).
+    Without known keyframes the source stays one chunk rather than seeking off-keyframe."""
+    starts = [0.0]
+    if keyframes:
+        kf = sorted(k for k in keyframes if 0 < k < duration)
+        t = segment_seconds
+        while kf and t < duration:
+            i = bisect.bisect_left(kf, t)
+            near = min(kf[max(0, i - 1):i + 1], key=lambda k: abs(k - t))
+            if near > starts[-1]:
+                starts.append(near)
+            t += segment_seconds
+    # Fold a tail shorter than half a chunk into the previous chunk
+    if len(starts) > 1 and duration - starts[-1] < segment_seconds / 2:
+        starts.pop()
+    return [(st, round(starts[i + 1] - st, 3) if i + 1 < len(starts) else None)
+            for i, st in enumerate(starts)]
+
+
+def uniquify_video_segmented(input_path, output_path, params, workers=None, threads=None,
+                             segment_seconds=SEGMENT_SECONDS, on_progress=None):
+    """Encode une variation par segments paralleles (coupes aux keyframes), puis concat sans re-encodage.
+    La video de chaque segment repart a PTS 0 (seek en entree) : setpts/fps s'appliquent par segment
+    et le demuxer concat enchaine les durees. L'audio (atempo/pitch) est encode d'un seul tenant
+    pour rester continu, puis remuxe avec la video.
+    on_progress(fraction) agrege les segments video, dans le thread appelant."""
+    modifications = params_to_modifications(params)
+    info = probe(input_path)
+    if not info or not info.duration:
+        return {"success": False, "error": "Duree inconnue (ffprobe indisponible)", "modifications": modifications}
+
+    orig_w, orig_h = _get_video_resolution(input_path)
+    video_filter = _build_video_filter(params, orig_w, orig_h)
+    bounds = _segment_bounds(info.duration, keyframe_times(input_path), segment_seconds)
+    workers, threads = encode_budget(len(bounds) + (1 if info.has_audio else 0), workers, threads)
+
+    tmpdir = tempfile.mkdtemp(prefix="tikfusion_seg_")
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        if result.returncode == 0:
+        jobs = []
+        chunk_paths = []
+        chunk_done = [0.0] * len(bounds)  # source seconds encoded per chunk
+
+        def _chunk_progress(i, length):
+            def _on_stats(stats):
+                if stats["out_time"] is not None:
+                    chunk_done[i] = min(length, stats["out_time"] * params["speed"])
+            return _on_stats
+
+        for i, (start, length) in enumerate(bounds):
+            chunk = os.path.join(tmpdir, f"chunk_{i:03d}.mp4")
+            chunk_paths.append(chunk)
+            cmd = [FFMPEG_BIN, "-y", "-threads", str(threads), "-ss", str(start)]
+            if length:
+                cmd.extend(["-t", str(length)])
+            cmd.extend(["-i", input_path, "-vf", video_filter, "-filter_threads", str(threads), "-an"])
+            cmd.extend(_video_codec_args(params) + ["-sn", "-dn", "-threads", str(threads), chunk])
+            jobs.append((cmd, _chunk_progress(i, length or info.duration - start)))
+
+        audio_path = None
+        if info.has_audio:
+            audio_path = os.path.join(tmpdir, "audio.m4a")
+            audio_filter = _build_audio_filter(params, info.sample_rate or 44100)
+            jobs.append(([FFMPEG_BIN, "-y", "-i", input_path, "-vn", "-af", audio_filter,
+                          "-c:a", "aac", "-b:a", "128k", audio_path], None))
+
+        reported = None
+
+        def _poll():
+            nonlocal reported
+            fraction = min(1.0, sum(chunk_done) / info.duration)
+            if on_progress and fraction != reported:
+                reported = fraction
+                on_progress(fraction)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run_ffmpeg, cmd, 300, cb) for cmd, cb in jobs]
+            for future in _wait_polling(futures, _poll):
+                ok, err = future.result()
+                if not ok:
+                    return {"success": False, "error": err, "modifications": modifications}
+
+        list_path = os.path.join(tmpdir, "chunks.txt")
+        with open(list_path, "w") as f:
+            for chunk in chunk_paths:
+                escaped = chunk.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        cmd = [FFMPEG_BIN, "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+        if audio_path:
+            cmd.extend(["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"])
+        cmd.extend(["-c", "copy", "-movflags", "+faststart", "-sn", "-dn"])
+        cmd.extend(_metadata_args(params))
+        cmd.append(output_path)
+        ok, err = _run_ffmpeg(cmd)
+        if ok:
             return {"success": True, "output_path": output_path, "modifications": modifications}
-        else:
-            return {"success": False, "error": result.stderr, "modifications": modifications}
-    except Exception as e:
-        return {"success": False, "error": str(e), "modifications": modifications}
+        return {"success": False, "error": err, "modifications": modifications}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def uniquify_batch_ffmpeg(input_path, output_paths, params_list, max_branches=None,
+                          workers=None, threads=None, on_result=None, segmented=False,
+                          on_progress=None, thumbnails=False):
+    """Encode N variations d'une meme source avec un seul decodage par groupe.
+    Les sorties sont regroupees par `max_branches` (memoire bornee) ; un process ffmpeg par groupe,
+    les groupes tournent en parallele selon encode_budget(workers, threads).
+    on_result(index, result) est appele dans le thread appelant a chaque sortie terminee,
+    on_progress(index, fraction) aussi, pendant l'encodage (ffmpeg -progress).
+    `segmented` : une source longue est encodee variation par variation, en segments paralleles.
+    `thumbnails` : chaque groupe ecrit aussi thumbnail + previews (cles "thumbnail"/"previews").
+    Retourne une liste de resultats (avec leur "plan"), dans l'ordre de output_paths."""
+    if segmented and _is_long_source(input_path):
+        results = []
+        for i, (output_path, params) in enumerate(zip(output_paths, params_list)):
+            progress = (lambda f, i=i: on_progress(i, f)) if on_progress else None
+            result = uniquify_video_segmented(input_path, output_path, params, workers, threads,
+                                              on_progress=progress)
+            result["plan"] = params
+            results.append(result)
+            if on_result:
+                on_result(i, result)
+        return results
+
+    max_branches = max(1, max_branches or MAX_BRANCHES_PER_PROCESS)
+
+    # Probe once for the whole batch
+    orig_w, orig_h = _get_video_resolution(input_path)
+    sample_rate = _get_audio_sample_rate(input_path)
+    has_audio = _has_audio_stream(input_path)
+    info = probe(input_path)
+    duration = info.duration if info else None
+
+    starts = list(range(0, len(output_paths), max_branches))
+    workers, threads = encode_budget(len(starts), workers, threads)
+    results = [None] * len(output_paths)
+
+    # Encode threads only write the latest fraction per group; the caller's thread reports it
+    fractions = {}
+    reported = {}
+
+    def _group_progress(start):
+        def _set(fraction):
+            fractions[start] = fraction
+        return _set if on_progress else None
+
+    def _poll():
+        for start, fraction in list(fractions.items()):
+            if reported.get(start) == fraction:
+                continue
+            reported[start] = fraction
+            for idx in range(start, min(start + max_branches, len(output_paths))):
+                on_progress(idx, fraction)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_uniquify_group, input_path, output_paths[start:start + max_branches],
+                            params_list[start:start + max_branches],
+                            orig_w, orig_h, sample_rate, has_audio, threads,
+                            duration, _group_progress(start), thumbnails): start
+            for start in starts
+        }
+        for future in _wait_polling(futures, _poll):
+            start = futures[future]
+            for k, result in enumerate(future.result()):
+                result["plan"] = params_list[start + k]
+                results[start + k] = result
+                if on_result:
+                    on_result(start + k, result)
+    return results
 
 def get_dated_folder_name():
     now = datetime.now()
@@ -332,41 +1108,28 @@ def get_dated_folder_name():
     }
     return f"{now.day} {mois_fr[now.month]} {now.strftime('%Hh%M')}"
 
-def _worker(args):
-    """Worker pour le traitement parallele."""
-    i, input_path, output_path, intensity, enabled_mods = args
-    result = uniquify_video_ffmpeg(input_path, output_path, intensity, enabled_mods)
-    result["variation"] = i + 1
-    result["output_path"] = output_path
-    return i, result
-
-def batch_uniquify(input_path, output_dir, count=10, intensity="medium", enabled_mods=None):
-    """Genere plusieurs variations en parallele (3-4x plus rapide)."""
+def batch_uniquify(input_path, output_dir, count=10, intensity="medium", enabled_mods=None,
+                   max_branches=None, workers=None, threads=None, seed=None):
+    """Genere plusieurs variations en parallele, plusieurs sorties par decodage."""
     folder_name = get_dated_folder_name()
     dated_dir = os.path.join(output_dir, folder_name)
     os.makedirs(dated_dir, exist_ok=True)
 
-    # Prepare tasks
-    tasks = []
-    for i in range(count):
-        output_path = os.path.join(dated_dir, f"V{i+1:02d}.mp4")
-        tasks.append((i, input_path, output_path, intensity, enabled_mods))
-
-    # Run in parallel — max 3 workers to avoid overloading Streamlit Cloud
-    max_workers = min(3, count)
-    results = [None] * count
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(_worker, task): task[0] for task in tasks}
-        for future in as_completed(futures):
-            idx, result = future.result()
-            results[idx] = result
+    # Plan all parameter sets first (diversity checked in Python, one encode each)
+    plans = VariationPlanner(intensity, enabled_mods, seed=seed).plan(count)
+    output_paths = [os.path.join(dated_dir, f"V{i+1:02d}.mp4") for i in range(count)]
 
+    results = uniquify_batch_ffmpeg(input_path, output_paths, plans, max_branches=max_branches,
+                                    workers=workers, threads=threads)
+    for i, result in enumerate(results):
+        result["variation"] = i + 1
+        result["output_path"] = output_paths[i]
     return results
 
 class VideoUniquifier:
     def __init__(self, intensity="medium"):
         self.intensity = intensity
 
-    def uniquify(self, input_path, output_path, enabled_mods=None):
-        return uniquify_video_ffmpeg(input_path, output_path, self.intensity, enabled_mods)
+    def uniquify(self, input_path, output_path, enabled_mods=None, seed=None, threads=None):
+        return uniquify_video_ffmpeg(input_path, output_path, self.intensity, enabled_mods, seed=seed,
+                                     threads=threads)
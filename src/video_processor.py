@@ -5,7 +5,8 @@ import subprocess
 import os
 from pathlib import Path
 
-from uniquifier import FFMPEG_BIN, FFPROBE_BIN
+from uniquifier import FFMPEG_BIN
+from media_probe import probe
 
 PLATFORM_SPECS = {
     "tiktok": {"width": 1080, "height": 1920, "max_duration": 180},
@@ -59,18 +60,10 @@ class VideoProcessor:
         base_name = Path(input_path).stem
         
         # Get duration
-        if not FFPROBE_BIN:
-            return []
-        probe_cmd = [
-            FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", input_path
-        ]
-        
-        try:
-            result = subprocess.run(probe_cmd, capture_output=True, text=True)
-            duration = float(result.stdout.strip())
-        except Exception:
+        info = probe(input_path)
+        if not info or not info.duration:
             return []
+        duration = info.duration
         
         clips = []
         start = 0